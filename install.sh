@@ -28,7 +28,7 @@ NC='\033[0m' # No Color
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 PROJECT_NAME="JarvisCO"
 VENV_DIR="$SCRIPT_DIR/venv"
-PYTHON_MIN_VERSION="3.8"
+PYTHON_MIN_VERSION="3.9"
 MODELS_DIR="$SCRIPT_DIR/models"
 CONFIG_DIR="$SCRIPT_DIR/config"
 LOG_FILE="$SCRIPT_DIR/install.log"
@@ -84,6 +84,10 @@ check_python() {
     fi
     
     PYTHON_VERSION=$(python3 -c 'import sys; print(".".join(map(str, sys.version_info[:2])))')
+    if ! python3 -c "import sys; sys.exit(sys.version_info < tuple(map(int, '$PYTHON_MIN_VERSION'.split('.'))))"; then
+        print_error "Python $PYTHON_MIN_VERSION or newer required (found $PYTHON_VERSION)"
+        exit 1
+    fi
     print_success "Python $PYTHON_VERSION detected"
     log_step "Python version: $PYTHON_VERSION"
 }
@@ -457,9 +461,9 @@ verify_installation() {
         all_good=false
     fi
     
-    # Check Python packages
+    # Check Python packages (find_spec locates them without importing)
     source "$VENV_DIR/bin/activate"
-    if python3 -c "import numpy, requests, librosa" 2>/dev/null; then
+    if python3 -c "import importlib.util, sys; sys.exit(any(importlib.util.find_spec(m) is None for m in ('numpy', 'requests', 'librosa')))" 2>/dev/null; then
         print_success "Core Python packages installed"
     else
         print_warning "Some Python packages may be missing"
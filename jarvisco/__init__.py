@@ -1,11 +1,32 @@
 """JarvisoCLI - A multi-agent orchestration framework for code reasoning and generation."""
 
-from jarvisco.agents.reasoning_agent import CodeReasoningAgent
-from jarvisco.tasks.code_task import CodeTask
-from jarvisco.cli import JarvisoCLI
+import importlib
+
+__version__ = "1.0.0"
+
+# Public names resolved on first access (PEP 562), so ``import jarvisco``
+# does not pull in the LLM stack until something actually needs it.
+_LAZY_EXPORTS = {
+    "JarvisoCLI": "jarvisco.cli",
+    "CodeReasoningAgent": "jarvisco.agent",
+    "CodeTask": "jarvisco.agent",
+}
 
 __all__ = [
     "JarvisoCLI",
     "CodeReasoningAgent",
     "CodeTask",
 ]
+
+
+def __getattr__(name):
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_EXPORTS))
@@ -11,10 +11,13 @@ Author: JarvisCO
 Date: 2025-12-30
 """
 
+import os
+import argparse
 import logging
 import asyncio
 import json
-from typing import Optional, Dict, List, Any
+from collections import OrderedDict, deque
+from typing import Optional, Dict, Any, Awaitable, Callable
 from dataclasses import dataclass, field
 from enum import Enum
 from datetime import datetime
@@ -88,18 +91,46 @@ class CodeReasoningAgent:
     3. Output formatting (OutputFormatter)
     """
     
-    def __init__(self, llm: Optional[MistralLLM] = None):
-        """Initialize agent."""
+    # History bounds so a long-running agent keeps constant memory (only
+    # finished tasks are evicted from the tracked set)
+    MAX_TRACKED_TASKS = 4096
+    MAX_COMPLETED_HISTORY = 1024
+    MAX_FAILED_HISTORY = 256
+    
+    def __init__(
+        self,
+        llm: Optional[MistralLLM] = None,
+        analyze_workers: Optional[int] = None,
+        max_concurrency: Optional[int] = None
+    ):
+        """
+        Initialize agent.
+        
+        Args:
+            llm: Shared language model (created if not given)
+            analyze_workers: Concurrent analysis workers (default: CPU count)
+            max_concurrency: Concurrent reasoning workers (default from
+                JARVIS_MAX_CONCURRENCY, else 8)
+        """
         self.llm = llm or MistralLLM()
         self.analyzer = CodeAnalyzer()
         self.reasoner = CodeReasoner(self.llm)
         self.formatter = OutputFormatter()
         
-        self.tasks: Dict[str, CodeTask] = {}
-        self.task_queue: asyncio.Queue = asyncio.Queue()
-        self.completed_tasks: List[CodeTask] = []
-        self.failed_tasks: List[CodeTask] = []
+        self.tasks: "OrderedDict[str, CodeTask]" = OrderedDict()
+        self.completed_tasks: "deque[CodeTask]" = deque(maxlen=self.MAX_COMPLETED_HISTORY)
+        self.failed_tasks: "deque[CodeTask]" = deque(maxlen=self.MAX_FAILED_HISTORY)
+        self.tasks_created = 0
         
+        # Pipeline: task_queue -> analyze -> reason -> format
+        self.task_queue: "asyncio.Queue[Optional[CodeTask]]" = asyncio.Queue()
+        self._reason_queue: "asyncio.Queue[Optional[CodeTask]]" = asyncio.Queue()
+        self._format_queue: "asyncio.Queue[Optional[CodeTask]]" = asyncio.Queue()
+        
+        self.analyze_workers = analyze_workers or os.cpu_count() or 1
+        self.max_concurrency = max_concurrency or int(
+            os.environ.get("JARVIS_MAX_CONCURRENCY", "8")
+        )
         self.running = False
         
         logger.info("CodeReasoningAgent initialized")
@@ -118,7 +149,8 @@ class CodeReasoningAgent:
         priority: TaskPriority = TaskPriority.NORMAL
     ) -> CodeTask:
         """Create a new code task."""
-        task_id = f"task_{len(self.tasks)}_{int(datetime.now().timestamp() * 1000)}"
+        task_id = f"task_{self.tasks_created}_{int(datetime.now().timestamp() * 1000)}"
+        self.tasks_created += 1
         task = CodeTask(
             id=task_id,
             description=description,
@@ -127,103 +159,161 @@ class CodeReasoningAgent:
             priority=priority
         )
         self.tasks[task_id] = task
+        if len(self.tasks) > self.MAX_TRACKED_TASKS:
+            self._evict_finished_task()
         logger.info(f"Created task: {task_id}")
         return task
     
+    def _evict_finished_task(self) -> None:
+        """Forget the oldest completed or failed task; pending work is kept."""
+        for task_id, tracked in self.tasks.items():
+            if tracked.status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+                del self.tasks[task_id]
+                return
+    
     async def submit_task(self, task: CodeTask) -> None:
         """Submit task for execution."""
         await self.task_queue.put(task)
         logger.info(f"Submitted task: {task.id}")
     
     async def process_tasks(self) -> None:
-        """Process task queue (main agent loop)."""
+        """
+        Process task queue (main agent loop).
+        
+        Runs the analyze, reason and format stages as independent worker
+        pools connected by queues, so different tasks can be in different
+        stages at the same time. Returns once shutdown() has been called
+        and every stage has drained.
+        
+        The reason pool's max_concurrency workers bound in-flight LLM work
+        the way the old semaphore did, and prompt batching now happens in
+        the LLM layer (BatchingLLM / generate_batch) rather than here.
+        """
         self.running = True
-        active_tasks = []
         
         logger.info("CodeReasoningAgent started processing tasks")
         
-        while self.running:
-            try:
-                # Get task from queue (with timeout)
+        analyze = asyncio.create_task(self._run_stage(
+            self.task_queue, self._reason_queue, self._analyze_stage, self.analyze_workers
+        ))
+        reason = asyncio.create_task(self._run_stage(
+            self._reason_queue, self._format_queue, self._reason_stage, self.max_concurrency
+        ))
+        format_ = asyncio.create_task(self._run_stage(
+            self._format_queue, None, self._format_stage, 1
+        ))
+        
+        # Each stage stops on sentinels once the stage before it has drained
+        await analyze
+        for _ in range(self.max_concurrency):
+            self._reason_queue.put_nowait(None)
+        await reason
+        self._format_queue.put_nowait(None)
+        await format_
+    
+    async def _run_stage(
+        self,
+        inbox: "asyncio.Queue[Optional[CodeTask]]",
+        outbox: "Optional[asyncio.Queue[Optional[CodeTask]]]",
+        handler: Callable[[CodeTask], Awaitable[None]],
+        workers: int
+    ) -> None:
+        """Run a pool of workers moving tasks from inbox through handler to outbox."""
+        async def worker() -> None:
+            while True:
+                task = await inbox.get()
+                if task is None:
+                    return
                 try:
-                    task = self.task_queue.get_nowait()
-                except asyncio.QueueEmpty:
-                    await asyncio.sleep(0.1)
+                    await handler(task)
+                except Exception as e:
+                    self._fail_task(task, e)
                     continue
-                
-                # Execute task
-                exec_task = asyncio.create_task(self._process_task(task))
-                active_tasks.append(exec_task)
-                
-            except Exception as e:
-                logger.error(f"Error in process_tasks: {e}")
-                await asyncio.sleep(1)
+                if outbox is not None:
+                    await outbox.put(task)
+        
+        await asyncio.gather(*(worker() for _ in range(workers)))
+    
+    async def _analyze_stage(self, task: CodeTask) -> None:
+        """STEP 1: Structural analysis."""
+        task.started_at = datetime.now()
+        task.status = TaskStatus.ANALYZING
+        
+        logger.info(f"Processing task {task.id}: {task.description}")
+        logger.info(f"[{task.id}] STEP 1: Analyzing code...")
+        
+        task.analysis_result = await asyncio.to_thread(self.analyzer.analyze_fast, task.code)
+        
+        if not task.analysis_result.get("success"):
+            raise Exception(f"Code analysis failed: {task.analysis_result.get('error')}")
     
-    async def _process_task(self, task: CodeTask) -> None:
-        """Process a single code task through the full pipeline."""
+    async def _reason_stage(self, task: CodeTask) -> None:
+        """
+        STEP 2: Reasoning, with mypy overlapped behind the LLM calls.
+        
+        The reasoner gets the structural analysis from STEP 1, so mypy runs
+        exactly once per task, in the background thread started here.
+        """
+        logger.info(f"[{task.id}] STEP 2: Reasoning about transformation...")
+        task.status = TaskStatus.REASONING
+        
+        type_check = asyncio.create_task(
+            asyncio.to_thread(self.analyzer.check_types, task.code)
+        )
+        
         try:
-            task.started_at = datetime.now()
-            task.status = TaskStatus.ANALYZING
-            
-            logger.info(f"Processing task {task.id}: {task.description}")
-            
-            # STEP 1: Analysis
-            logger.info(f"[{task.id}] STEP 1: Analyzing code...")
-            task.analysis_result = self.analyzer.analyze(task.code)
-            
-            if not task.analysis_result.get("success"):
-                raise Exception(f"Code analysis failed: {task.analysis_result.get('error')}")
-            
-            # STEP 2: Reasoning (Core Copilot)
-            logger.info(f"[{task.id}] STEP 2: Reasoning about transformation...")
-            task.status = TaskStatus.REASONING
-            
             reasoning_result = await self.reasoner.transform_code(
                 code=task.code,
                 intent=task.description,
                 transform_type=task.transform_type,
-                context=json.dumps(task.analysis_result.get("metrics", {}))
-            )
-            
-            task.reasoning_result = {
-                "success": reasoning_result.success,
-                "confidence": reasoning_result.confidence_score,
-                "transformed_code": reasoning_result.transformed_code,
-                "reasoning_steps": [
-                    {
-                        "step": step.step_num,
-                        "thought": step.thought,
-                        "action": step.action,
-                        "confidence": step.confidence
-                    }
-                    for step in reasoning_result.reasoning_steps
-                ],
-                "validation_errors": reasoning_result.validation_errors,
-                "explanation": reasoning_result.explanation
-            }
-            
-            # STEP 3: Formatting
-            logger.info(f"[{task.id}] STEP 3: Formatting output...")
-            task.status = TaskStatus.EXECUTING
-            
-            task.formatted_output = self.formatter.format_transformation_report(
-                task.reasoning_result
+                context=json.dumps(task.analysis_result.get("metrics", {})),
+                analysis=task.analysis_result
             )
-            
-            # Completion
-            task.status = TaskStatus.COMPLETED
-            task.completed_at = datetime.now()
-            self.completed_tasks.append(task)
-            
-            logger.info(f"✓ Task completed: {task.id}")
-            logger.info(f"  Confidence: {task.reasoning_result.get('confidence', 0):.0%}")
-            
-        except Exception as e:
-            logger.error(f"Task failed: {task.id} - {e}")
-            task.error = str(e)
-            task.status = TaskStatus.FAILED
-            task.completed_at = datetime.now()
-            self.failed_tasks.append(task)
+        finally:
+            type_issues = await type_check
+        
+        self.analyzer.merge_issues(task.analysis_result, type_issues)
+        
+        task.reasoning_result = {
+            "success": reasoning_result.success,
+            "confidence": reasoning_result.confidence_score,
+            "transformed_code": reasoning_result.transformed_code,
+            "reasoning_steps": [
+                {
+                    "step": step.step_num,
+                    "thought": step.thought,
+                    "action": step.action,
+                    "confidence": step.confidence
+                }
+                for step in reasoning_result.reasoning_steps
+            ],
+            "validation_errors": reasoning_result.validation_errors,
+            "explanation": reasoning_result.explanation
+        }
+    
+    async def _format_stage(self, task: CodeTask) -> None:
+        """STEP 3: Formatting and completion."""
+        logger.info(f"[{task.id}] STEP 3: Formatting output...")
+        task.status = TaskStatus.EXECUTING
+        
+        task.formatted_output = self.formatter.format_transformation_report(
+            task.reasoning_result
+        )
+        
+        task.status = TaskStatus.COMPLETED
+        task.completed_at = datetime.now()
+        self.completed_tasks.append(task)
+        
+        logger.info(f"✓ Task completed: {task.id}")
+        logger.info(f"  Confidence: {task.reasoning_result.get('confidence', 0):.0%}")
+    
+    def _fail_task(self, task: CodeTask, error: Exception) -> None:
+        """Mark a task as failed."""
+        logger.error(f"Task failed: {task.id} - {error}")
+        task.error = str(error)
+        task.status = TaskStatus.FAILED
+        task.completed_at = datetime.now()
+        self.failed_tasks.append(task)
     
     async def analyze_code(self, code: str) -> Dict:
         """Quick code analysis (without reasoning)."""
@@ -253,27 +343,34 @@ class CodeReasoningAgent:
         """Get agent status."""
         return {
             "running": self.running,
-            "total_tasks": len(self.tasks),
+            "total_tasks": self.tasks_created,
+            "tracked_tasks": len(self.tasks),
             "completed": len(self.completed_tasks),
             "failed": len(self.failed_tasks),
-            "queue_size": self.task_queue.qsize()
+            "queue_size": self.task_queue.qsize(),
+            "reasoning_queue_size": self._reason_queue.qsize(),
+            "formatting_queue_size": self._format_queue.qsize()
         }
     
     def get_task_result(self, task_id: str) -> Optional[CodeTask]:
         """Get result of completed task."""
-        return self.tasks.get(task_id)
+        task = self.tasks.get(task_id)
+        if task is not None:
+            self.tasks.move_to_end(task_id)
+        return task
     
     async def shutdown(self) -> None:
         """Shutdown agent."""
         logger.info("Shutting down CodeReasoningAgent...")
         self.running = False
+        # One sentinel per analysis worker; later stages are drained in turn
+        for _ in range(self.analyze_workers):
+            self.task_queue.put_nowait(None)
         logger.info("Agent shutdown complete")
 
 
 async def main():
     """Main entry point."""
-    import argparse
-    
     parser = argparse.ArgumentParser(description="JarvisCO Code Reasoning Agent")
     parser.add_argument("--code", help="Code file to analyze")
     parser.add_argument("--intent", help="Transformation intent")
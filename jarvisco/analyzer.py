@@ -16,15 +16,129 @@ Date: 2025-12-30
 """
 
 import ast
+import atexit
+import copy
+import hashlib
 import logging
+import os
+import re
+import shutil
+import signal
+import tempfile
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Any, Optional, Tuple
 from dataclasses import dataclass, field
-from pathlib import Path
 import subprocess
 import json
 
+try:
+    from mypy import api as mypy_api
+    MYPY_AVAILABLE = True
+except ImportError:
+    MYPY_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+# "file.py:12: error: msg" or "file.py:12:5: error: msg" (--show-column-numbers)
+_MYPY_LINE_RE = re.compile(
+    r'^(?P<file>.+?):(?P<line>\d+):(?:\d+:)?\s*(?P<severity>error|warning):\s*(?P<message>.*)$'
+)
+
+# mypy's in-process API redirects global streams; serialize callers
+_mypy_lock = threading.Lock()
+
+# Seconds an idle dmypy server lingers, in case atexit never runs
+DMYPY_IDLE_TIMEOUT = 600
+
+# Larger sources reach the mypy CLI through a temp file, not `-c`: one argv
+# element is capped at 128 KB on Linux, a whole command line at 32 KB on Windows
+MYPY_INLINE_MAX_BYTES = 16 * 1024
+
+
+class _MypyDaemon:
+    """
+    A dmypy server kept warm for bounded type checks.
+    
+    The server is started on the first check and reused, so a check costs
+    one request instead of a fresh mypy process. A check that overruns its
+    timeout kills the server; the next check starts a new one.
+    """
+    
+    def __init__(self) -> None:
+        self._dir: Optional[str] = None
+    
+    def check(self, code: str, timeout: float) -> Optional[str]:
+        """Type check code; returns mypy's report, or None on timeout."""
+        with _mypy_lock:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix="jarvisco-dmypy-")
+                atexit.register(self.close)
+            
+            # A new name per source makes the daemon see a changed file
+            digest = hashlib.blake2b(code.encode('utf-8'), digest_size=8).hexdigest()
+            path = os.path.join(self._dir, f"snippet_{digest}.py")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(code)
+            
+            result: Dict[str, str] = {}
+            worker = threading.Thread(target=self._run, args=(path, result), daemon=True)
+            try:
+                worker.start()
+                worker.join(timeout)
+                if worker.is_alive():
+                    # The client blocks on the server; killing it unblocks the client
+                    self._kill()
+                    worker.join()
+                    return None
+                return result.get('stdout', '')
+            finally:
+                os.remove(path)
+    
+    def close(self) -> None:
+        """Stop the server and remove its working directory."""
+        with _mypy_lock:
+            if self._dir is None:
+                return
+            self._kill()
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+    
+    def _run(self, path: str, result: Dict[str, str]) -> None:
+        """Send one `dmypy run`, starting the server if it is not up."""
+        result['stdout'], _, _ = mypy_api.run_dmypy([
+            '--status-file', os.path.join(self._dir, 'status.json'),
+            'run', '--timeout', str(DMYPY_IDLE_TIMEOUT), '--',
+            '--ignore-missing-imports',
+            '--cache-dir', os.path.join(self._dir, 'cache'),
+            path
+        ])
+    
+    def _kill(self) -> None:
+        """Terminate the server process, if one is running."""
+        status_file = os.path.join(self._dir, 'status.json')
+        try:
+            with open(status_file, encoding='utf-8') as f:
+                pid = json.load(f)['pid']
+            os.remove(status_file)
+            os.kill(pid, signal.SIGTERM)
+        except (OSError, ValueError, KeyError):
+            pass
+
+
+_mypy_daemon = _MypyDaemon()
+
+# Analysis results keyed by (blake2b digest of the source, filename, check_types)
+ANALYSIS_CACHE_SIZE = 256
+_analysis_cache: "OrderedDict[Tuple[bytes, str, bool], Dict[str, Any]]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+# Parsed trees keyed by blake2b digest of the source, shared by analyze()
+# and callers that only need a syntax check
+PARSE_CACHE_SIZE = 64
+_parse_cache: "OrderedDict[bytes, ast.Module]" = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
 
 @dataclass
 class CodeEntity:
@@ -62,85 +176,50 @@ class TypeInfo:
     confidence: float = 1.0
 
 
-class CodeAnalyzer:
-    """Deep code analysis using AST and type checking."""
+class _AnalysisVisitor(ast.NodeVisitor):
+    """
+    Single pre-order pass over the AST.
+    
+    Collects entities, imports, type hints and quality issues, and
+    attributes branch complexity to the innermost enclosing function.
+    """
     
     def __init__(self):
-        """Initialize analyzer."""
+        """Initialize collectors."""
         self.entities: Dict[str, List[CodeEntity]] = {}
         self.issues: List[CodeIssue] = []
         self.types: Dict[str, TypeInfo] = {}
         self.imports: List[Tuple[str, str]] = []
-        self.dependencies: Dict[str, List[str]] = {}
-        
-    def analyze(self, code: str, filename: str = "<stdin>") -> Dict[str, Any]:
-        """
-        Analyze code comprehensively.
-        
-        Args:
-            code: Source code to analyze
-            filename: Filename for context
-            
-        Returns:
-            Dictionary with analysis results
-        """
-        try:
-            tree = ast.parse(code)
-        except SyntaxError as e:
-            logger.error(f"Syntax error in {filename}: {e}")
-            return {
-                "success": False,
-                "error": str(e),
-                "line": e.lineno
-            }
-        
-        # Extract entities
-        self._extract_entities(tree)
-        
-        # Extract imports
-        self._extract_imports(tree)
-        
-        # Analyze complexity
-        self._analyze_complexity(tree)
-        
-        # Type inference
-        self._infer_types(tree)
-        
-        # Style and quality checks
-        self._check_code_quality(tree, code)
-        
-        # Type checking with mypy (if available)
-        self._run_mypy_check(code, filename)
-        
-        return {
-            "success": True,
-            "entities": self._serialize_entities(),
-            "issues": self._serialize_issues(),
-            "types": self._serialize_types(),
-            "imports": self.imports,
-            "dependencies": self.dependencies,
-            "metrics": self._calculate_metrics(),
-            "complexity": self._get_overall_complexity()
-        }
+        self.entity_count = 0
+        self.total_lines = 0
+        self._func_stack: List[CodeEntity] = []
     
-    def _extract_entities(self, tree: ast.AST) -> None:
-        """Extract functions, classes, and variables."""
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                self._extract_function(node)
-            elif isinstance(node, ast.ClassDef):
-                self._extract_class(node)
-            elif isinstance(node, ast.Assign):
-                self._extract_variable(node)
-    
-    def _extract_function(self, node: ast.FunctionDef) -> None:
-        """Extract function information."""
+    def _add_entity(self, entity: CodeEntity) -> None:
+        """Register an entity under its type."""
+        self.entities.setdefault(entity.entity_type, []).append(entity)
+        self.entity_count += 1
+        self.total_lines += entity.line_end - entity.line_start
+    
+    def _check_docstring(self, node: ast.AST, docstring: Optional[str]) -> None:
+        """Flag public definitions without a docstring."""
+        if not docstring and not node.name.startswith('_'):
+            self.issues.append(CodeIssue(
+                severity='info',
+                category='maintainability',
+                message=f"Missing docstring for {node.__class__.__name__} '{node.name}'",
+                line=node.lineno,
+                suggestion="Add docstring documentation"
+            ))
+    
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> None:
+        """Extract function information, types and quality issues."""
+        docstring = ast.get_docstring(node)
         entity = CodeEntity(
             name=node.name,
             entity_type='function',
             line_start=node.lineno,
             line_end=node.end_lineno or node.lineno,
-            docstring=ast.get_docstring(node),
+            docstring=docstring,
             parameters=[arg.arg for arg in node.args.args],
             is_public=not node.name.startswith('_'),
             decorators=[
@@ -153,189 +232,345 @@ class CodeAnalyzer:
         if node.returns:
             entity.return_type = ast.unparse(node.returns)
         
-        if 'function' not in self.entities:
-            self.entities['function'] = []
-        self.entities['function'].append(entity)
+        self._add_entity(entity)
+        
+        # Type annotations on arguments
+        for arg in node.args.args:
+            if arg.annotation:
+                self.types[arg.arg] = TypeInfo(
+                    name=arg.arg,
+                    type_hint=ast.unparse(arg.annotation)
+                )
+        
+        # Check for long functions
+        func_length = entity.line_end - entity.line_start
+        if func_length > 50:
+            self.issues.append(CodeIssue(
+                severity='warning',
+                category='maintainability',
+                message=f"Function '{node.name}' is {func_length} lines long",
+                line=node.lineno,
+                suggestion="Consider breaking into smaller functions"
+            ))
+        
+        self._check_docstring(node, docstring)
+        
+        self._func_stack.append(entity)
+        self.generic_visit(node)
+        self._func_stack.pop()
+    
+    visit_AsyncFunctionDef = visit_FunctionDef
     
-    def _extract_class(self, node: ast.ClassDef) -> None:
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
         """Extract class information."""
-        entity = CodeEntity(
+        docstring = ast.get_docstring(node)
+        self._add_entity(CodeEntity(
             name=node.name,
             entity_type='class',
             line_start=node.lineno,
             line_end=node.end_lineno or node.lineno,
-            docstring=ast.get_docstring(node),
+            docstring=docstring,
             is_public=not node.name.startswith('_')
-        )
-        
-        if 'class' not in self.entities:
-            self.entities['class'] = []
-        self.entities['class'].append(entity)
+        ))
+        self._check_docstring(node, docstring)
+        self.generic_visit(node)
     
-    def _extract_variable(self, node: ast.Assign) -> None:
+    def visit_Assign(self, node: ast.Assign) -> None:
         """Extract variable assignments."""
         for target in node.targets:
             if isinstance(target, ast.Name):
-                entity = CodeEntity(
+                self._add_entity(CodeEntity(
                     name=target.id,
                     entity_type='variable',
                     line_start=node.lineno,
                     line_end=node.end_lineno or node.lineno,
                     is_public=not target.id.startswith('_')
-                )
-                
-                if 'variable' not in self.entities:
-                    self.entities['variable'] = []
-                self.entities['variable'].append(entity)
+                ))
+        self.generic_visit(node)
     
-    def _extract_imports(self, tree: ast.AST) -> None:
+    def visit_Import(self, node: ast.Import) -> None:
         """Extract import statements."""
-        for node in ast.walk(tree):
-            if isinstance(node, ast.Import):
-                for alias in node.names:
-                    self.imports.append(('import', alias.name))
-            elif isinstance(node, ast.ImportFrom):
-                for alias in node.names:
-                    self.imports.append(('from', f"{node.module}.{alias.name}"))
-    
-    def _analyze_complexity(self, tree: ast.AST) -> None:
-        """Analyze cyclomatic complexity."""
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                complexity = self._calculate_function_complexity(node)
-                for entity in self.entities.get('function', []):
-                    if entity.name == node.name:
-                        entity.complexity = complexity
-                        break
-    
-    def _calculate_function_complexity(self, node: ast.FunctionDef) -> int:
-        """Calculate cyclomatic complexity of a function."""
-        complexity = 1
-        for child in ast.walk(node):
-            if isinstance(child, (ast.If, ast.While, ast.For, ast.ExceptHandler)):
-                complexity += 1
-            elif isinstance(child, ast.BoolOp):
-                complexity += len(child.values) - 1
-        return complexity
-    
-    def _infer_types(self, tree: ast.AST) -> None:
-        """Infer types from annotations and usage."""
-        # Extract type annotations
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                for arg in node.args.args:
-                    if arg.annotation:
-                        type_str = ast.unparse(arg.annotation)
-                        self.types[arg.arg] = TypeInfo(
-                            name=arg.arg,
-                            type_hint=type_str
-                        )
-    
-    def _check_code_quality(self, tree: ast.AST, code: str) -> None:
-        """Check code quality issues."""
-        lines = code.split('\n')
+        for alias in node.names:
+            self.imports.append(('import', alias.name))
+    
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        """Extract from-import statements."""
+        for alias in node.names:
+            self.imports.append(('from', f"{node.module}.{alias.name}"))
+    
+    def _add_complexity(self, amount: int) -> None:
+        """Add cyclomatic complexity to the enclosing function."""
+        if self._func_stack:
+            self._func_stack[-1].complexity += amount
+    
+    def visit_If(self, node: ast.AST) -> None:
+        """Count a decision point."""
+        self._add_complexity(1)
+        self.generic_visit(node)
+    
+    visit_While = visit_If
+    visit_For = visit_If
+    visit_ExceptHandler = visit_If
+    
+    def visit_BoolOp(self, node: ast.BoolOp) -> None:
+        """Count short-circuit operands as decision points."""
+        self._add_complexity(len(node.values) - 1)
+        self.generic_visit(node)
+
+
+class CodeAnalyzer:
+    """
+    Deep code analysis using AST and type checking.
+    
+    The analyzer keeps no per-call state, so a single instance can be
+    shared and reused across any number of ``analyze()`` calls.
+    """
+    
+    def analyze(
+        self,
+        code: str,
+        filename: str = "<stdin>",
+        check_types: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Analyze code comprehensively.
         
-        # Check for long functions
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                func_length = (node.end_lineno or node.lineno) - node.lineno
-                if func_length > 50:
-                    self.issues.append(CodeIssue(
-                        severity='warning',
-                        category='maintainability',
-                        message=f"Function '{node.name}' is {func_length} lines long",
-                        line=node.lineno,
-                        suggestion="Consider breaking into smaller functions"
-                    ))
+        Results are cached by a hash of the source, so analyzing the same
+        snippet again skips parsing and the mypy run.
         
-        # Check for missing docstrings
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
-                if not ast.get_docstring(node) and node.name.startswith('_') is False:
-                    self.issues.append(CodeIssue(
-                        severity='info',
-                        category='maintainability',
-                        message=f"Missing docstring for {node.__class__.__name__} '{node.name}'",
-                        line=node.lineno,
-                        suggestion="Add docstring documentation"
-                    ))
+        Args:
+            code: Source code to analyze
+            filename: Filename for context
+            check_types: Run mypy as part of the analysis
+            
+        Returns:
+            Dictionary with analysis results
+        """
+        key = (
+            hashlib.blake2b(code.encode('utf-8'), digest_size=16).digest(),
+            filename,
+            check_types
+        )
+        
+        with _analysis_cache_lock:
+            result = _analysis_cache.get(key)
+            if result is not None:
+                _analysis_cache.move_to_end(key)
+        
+        if result is None:
+            result = self._analyze_uncached(code, filename, check_types)
+            with _analysis_cache_lock:
+                _analysis_cache[key] = result
+                if len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+                    _analysis_cache.popitem(last=False)
+        
+        # Callers are free to mutate what they get back
+        return copy.deepcopy(result)
+    
+    def analyze_fast(self, code: str, filename: str = "<stdin>") -> Dict[str, Any]:
+        """Analyze code structure only, without running mypy."""
+        return self.analyze(code, filename, check_types=False)
+    
+    def check_types(
+        self,
+        code: str,
+        filename: str = "<stdin>",
+        timeout: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        Type check code with mypy.
+        
+        Blocking; run it in a worker thread to overlap it with other work.
+        
+        Args:
+            code: Source code to check
+            filename: Filename for context
+            timeout: Seconds after which the check is abandoned. In-process
+                mypy cannot be interrupted, so a bounded check goes to a
+                dmypy server that is killed if it overruns.
+        
+        Returns:
+            Serialized type issues (empty if the check timed out)
+        """
+        return self._serialize_issues(self._run_mypy_check(code, filename, timeout))
+    
+    def parse(self, code: str) -> ast.Module:
+        """
+        Parse code into an AST, reusing the tree of an identical source.
+        
+        The returned tree is shared and must not be modified.
+        
+        Raises:
+            SyntaxError: If the code does not parse
+        """
+        key = hashlib.blake2b(code.encode('utf-8'), digest_size=16).digest()
+        with _parse_cache_lock:
+            tree = _parse_cache.get(key)
+            if tree is not None:
+                _parse_cache.move_to_end(key)
+                return tree
+        
+        tree = compile(code, '<unknown>', 'exec', ast.PyCF_ONLY_AST)
+        with _parse_cache_lock:
+            _parse_cache[key] = tree
+            if len(_parse_cache) > PARSE_CACHE_SIZE:
+                _parse_cache.popitem(last=False)
+        return tree
+    
+    def merge_issues(self, analysis: Dict[str, Any], issues: List[Dict]) -> None:
+        """Merge serialized issues into an analysis result and its metrics."""
+        if not issues:
+            return
+        analysis["issues"].extend(issues)
+        metrics = analysis["metrics"]
+        metrics["issues_count"] += len(issues)
+        by_severity = metrics["issues_by_severity"]
+        for issue in issues:
+            by_severity[issue["severity"]] = by_severity.get(issue["severity"], 0) + 1
+    
+    @staticmethod
+    def clear_cache() -> None:
+        """Drop all cached analysis results."""
+        with _analysis_cache_lock:
+            _analysis_cache.clear()
+        with _parse_cache_lock:
+            _parse_cache.clear()
+    
+    def _analyze_uncached(
+        self,
+        code: str,
+        filename: str,
+        check_types: bool
+    ) -> Dict[str, Any]:
+        """Run the full analysis pipeline on code."""
+        try:
+            tree = self.parse(code)
+        except SyntaxError as e:
+            logger.error(f"Syntax error in {filename}: {e}")
+            return {
+                "success": False,
+                "error": str(e),
+                "line": e.lineno
+            }
+        
+        # Entities, imports, complexity, types and quality checks in one pass
+        visitor = _AnalysisVisitor()
+        visitor.visit(tree)
+        entities = visitor.entities
+        issues = visitor.issues
+        
+        # Type checking with mypy (if available)
+        if check_types:
+            issues.extend(self._run_mypy_check(code, filename))
+        
+        return {
+            "success": True,
+            "entities": self._serialize_entities(entities),
+            "issues": self._serialize_issues(issues),
+            "types": self._serialize_types(visitor.types),
+            "imports": visitor.imports,
+            "dependencies": {},
+            "metrics": self._calculate_metrics(visitor),
+            "complexity": self._get_overall_complexity(entities)
+        }
     
-    def _run_mypy_check(self, code: str, filename: str) -> None:
+    def _run_mypy_check(
+        self,
+        code: str,
+        filename: str,
+        timeout: Optional[float] = None
+    ) -> List[CodeIssue]:
         """Run mypy type checking."""
+        issues: List[CodeIssue] = []
         try:
-            # Write code to temp file
-            temp_file = Path(f"/tmp/{filename}")
-            temp_file.write_text(code)
+            # Pass the source as program text; nothing is written to disk
+            args = ['--ignore-missing-imports', '-c', code]
             
-            # Run mypy
-            result = subprocess.run(
-                ['mypy', str(temp_file), '--ignore-missing-imports'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
+            # Run mypy in-process when importable to skip interpreter startup;
+            # a run that must be killable goes to the warm daemon instead
+            if MYPY_AVAILABLE and timeout is not None:
+                stdout = _mypy_daemon.check(code, timeout)
+                if stdout is None:
+                    logger.debug(f"mypy timed out for {filename}")
+                    return issues
+            elif MYPY_AVAILABLE:
+                with _mypy_lock:
+                    stdout, _, _ = mypy_api.run(args)
+            else:
+                stdout = self._run_mypy_subprocess(code, timeout or 5)
             
             # Parse mypy output
-            for line in result.stdout.split('\n'):
-                if ':' in line and 'error' in line.lower():
-                    parts = line.split(':')
-                    if len(parts) >= 3:
-                        try:
-                            line_num = int(parts[1])
-                            message = ':'.join(parts[3:]).strip()
-                            self.issues.append(CodeIssue(
-                                severity='error',
-                                category='type',
-                                message=message,
-                                line=line_num
-                            ))
-                        except (ValueError, IndexError):
-                            pass
-        
-        except (FileNotFoundError, subprocess.TimeoutExpired):
-            logger.debug("mypy not available or timed out")
-    
-    def _calculate_metrics(self) -> Dict[str, Any]:
-        """Calculate code metrics."""
-        total_lines = sum(
-            e.line_end - e.line_start
-            for entities in self.entities.values()
-            for e in entities
-        )
+            for line in stdout.splitlines():
+                match = _MYPY_LINE_RE.match(line)
+                if match:
+                    issues.append(CodeIssue(
+                        severity=match['severity'],
+                        category='type',
+                        message=match['message'].strip(),
+                        line=int(match['line'])
+                    ))
         
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.debug(f"mypy check skipped for {filename}: {e}")
+        
+        return issues
+    
+    def _run_mypy_subprocess(self, code: str, timeout: float) -> str:
+        """Run the mypy CLI on code and return its report."""
+        def run(target: List[str]) -> str:
+            return subprocess.run(
+                ['mypy', '--ignore-missing-imports', *target],
+                capture_output=True,
+                text=True,
+                timeout=timeout
+            ).stdout
+        
+        if len(code.encode('utf-8')) <= MYPY_INLINE_MAX_BYTES:
+            return run(['-c', code])
+        with tempfile.TemporaryDirectory(prefix="jarvisco-mypy-") as tmp:
+            path = os.path.join(tmp, 'snippet.py')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(code)
+            return run([path])
+    
+    def _calculate_metrics(self, visitor: _AnalysisVisitor) -> Dict[str, Any]:
+        """Calculate code metrics from the counters gathered while visiting."""
+        entities = visitor.entities
         return {
-            "total_entities": sum(len(e) for e in self.entities.values()),
-            "functions": len(self.entities.get('function', [])),
-            "classes": len(self.entities.get('class', [])),
-            "variables": len(self.entities.get('variable', [])),
-            "imports": len(self.imports),
-            "total_lines": total_lines,
-            "issues_count": len(self.issues),
-            "issues_by_severity": self._count_issues_by_severity()
+            "total_entities": visitor.entity_count,
+            "functions": len(entities.get('function', [])),
+            "classes": len(entities.get('class', [])),
+            "variables": len(entities.get('variable', [])),
+            "imports": len(visitor.imports),
+            "total_lines": visitor.total_lines,
+            "issues_count": len(visitor.issues),
+            "issues_by_severity": self._count_issues_by_severity(visitor.issues)
         }
     
-    def _count_issues_by_severity(self) -> Dict[str, int]:
+    def _count_issues_by_severity(self, issues: List[CodeIssue]) -> Dict[str, int]:
         """Count issues by severity."""
         counts = {'error': 0, 'warning': 0, 'info': 0}
-        for issue in self.issues:
+        for issue in issues:
             counts[issue.severity] = counts.get(issue.severity, 0) + 1
         return counts
     
-    def _get_overall_complexity(self) -> int:
+    def _get_overall_complexity(self, entities: Dict[str, List[CodeEntity]]) -> int:
         """Get overall code complexity score."""
-        if not self.entities.get('function'):
+        functions = entities.get('function')
+        if not functions:
             return 1
         
-        avg_complexity = sum(
-            f.complexity for f in self.entities['function']
-        ) / len(self.entities['function'])
+        avg_complexity = sum(f.complexity for f in functions) / len(functions)
         
         return int(avg_complexity)
     
-    def _serialize_entities(self) -> Dict[str, List[Dict]]:
+    def _serialize_entities(
+        self,
+        entities: Dict[str, List[CodeEntity]]
+    ) -> Dict[str, List[Dict]]:
         """Serialize entities to dictionary."""
         result = {}
-        for entity_type, entities in self.entities.items():
+        for entity_type, group in entities.items():
             result[entity_type] = [
                 {
                     "name": e.name,
@@ -348,11 +583,11 @@ class CodeAnalyzer:
                     "is_public": e.is_public,
                     "complexity": e.complexity
                 }
-                for e in entities
+                for e in group
             ]
         return result
     
-    def _serialize_issues(self) -> List[Dict]:
+    def _serialize_issues(self, issues: List[CodeIssue]) -> List[Dict]:
         """Serialize issues to dictionary."""
         return [
             {
@@ -362,10 +597,10 @@ class CodeAnalyzer:
                 "line": i.line,
                 "suggestion": i.suggestion
             }
-            for i in self.issues
+            for i in issues
         ]
     
-    def _serialize_types(self) -> Dict[str, Dict]:
+    def _serialize_types(self, types: Dict[str, TypeInfo]) -> Dict[str, Dict]:
         """Serialize types to dictionary."""
         return {
             name: {
@@ -374,28 +609,39 @@ class CodeAnalyzer:
                 "is_optional": t.is_optional,
                 "confidence": t.confidence
             }
-            for name, t in self.types.items()
+            for name, t in types.items()
         }
     
-    def suggest_refactoring(self, code: str) -> List[str]:
+    def suggest_refactoring(
+        self,
+        code: str,
+        analysis: Optional[Dict[str, Any]] = None
+    ) -> List[str]:
         """
         Suggest refactoring improvements.
         
+        Args:
+            code: Source code to inspect
+            analysis: Existing analysis of ``code``; computed if not given
+            
         Returns:
             List of refactoring suggestions
         """
         suggestions = []
         
-        analysis = self.analyze(code)
+        if analysis is None:
+            analysis = self.analyze(code)
+        if not analysis.get("success"):
+            return suggestions
         
         # Suggest based on complexity
         if analysis['complexity'] > 5:
             suggestions.append("Consider reducing complexity by breaking into smaller functions")
         
         # Suggest based on issues
-        for issue in self.issues:
-            if issue.suggestion:
-                suggestions.append(issue.suggestion)
+        for issue in analysis['issues']:
+            if issue['suggestion']:
+                suggestions.append(issue['suggestion'])
         
         # Suggest based on metrics
         metrics = analysis['metrics']
@@ -14,48 +14,205 @@ Author: JarvisCO
 Date: 2025-12-30
 """
 
+import os
 import sys
 import argparse
+import hashlib
 import logging
 import asyncio
 import json
+from functools import cached_property
 from pathlib import Path
-from typing import Optional
+from typing import Awaitable, Callable, List, Optional
 
 from jarvisco.analyzer import CodeAnalyzer
-from jarvisco.reasoner import CodeReasoner, TransformationType
+from jarvisco.reasoner import (
+    CodeReasoner,
+    ReasoningStep,
+    TransformationResult,
+    TransformationType,
+)
 from jarvisco.formatter import OutputFormatter
 from jarvisco.mistral_llm import MistralLLM
 from jarvisco import __version__
 
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CACHE_DIR = Path("~/.jarvisco/cache").expanduser()
+
+READ_CHUNK_SIZE = 1 << 20
+
+# CLI spelling ("fix_bug") -> enum member, resolved once at import
+_TRANSFORM_TYPES = {
+    name.lower(): member for name, member in TransformationType.__members__.items()
+}
+
+
+def _read_text(path: str) -> str:
+    """Read a UTF-8 file straight from its descriptor."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunks = []
+        while True:
+            chunk = os.read(fd, READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+    return b"".join(chunks).decode("utf-8")
+
+
+def _write_text(path: str, text: str) -> None:
+    """Encode text once and write it straight to a descriptor."""
+    data = memoryview(text.encode("utf-8"))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
 
 class JarvisoCLI:
     """Copilot-level CLI interface."""
     
-    def __init__(self):
-        """Initialize CLI."""
-        self.llm = MistralLLM()
-        self.analyzer = CodeAnalyzer()
-        self.reasoner = CodeReasoner(self.llm)
-        self.formatter = OutputFormatter()
+    def __init__(
+        self,
+        use_cache: bool = True,
+        quantization: str = "none",
+        small_model: Optional[str] = None
+    ):
+        """
+        Initialize CLI.
+        
+        Args:
+            use_cache: Reuse cached transformation results from CACHE_DIR
+            quantization: Weight quantization for the language model
+                (one of MistralLLM.QUANTIZATION_MODES)
+            small_model: Model for simple document/test transformations
+                (one of MistralLLM.SUPPORTED_MODELS; none routes all to llm)
+        """
+        self.use_cache = use_cache
+        self.quantization = quantization
+        self.small_model = small_model
+        self.cache_dir = CACHE_DIR
+    
+    # Components are built on first use, so analyze/document/report never
+    # load the language model.
+    
+    @cached_property
+    def llm(self) -> MistralLLM:
+        """Language model used by the reasoner."""
+        return MistralLLM(quantization=self.quantization)
+    
+    @cached_property
+    def analyzer(self) -> CodeAnalyzer:
+        """Code analyzer."""
+        return CodeAnalyzer()
+    
+    @cached_property
+    def reasoner(self) -> CodeReasoner:
+        """Reasoner backed by the language model."""
+        small_llm = None
+        if self.small_model:
+            small_llm = MistralLLM(self.small_model, quantization=self.quantization)
+        return CodeReasoner(self.llm, small_llm)
+    
+    @cached_property
+    def formatter(self) -> OutputFormatter:
+        """Output formatter."""
+        return OutputFormatter()
     
     def load_code(self, path: str) -> str:
-        """Load code from file."""
-        try:
-            return Path(path).read_text()
-        except FileNotFoundError:
-            logger.error(f"File not found: {path}")
-            sys.exit(1)
+        """
+        Load code from file.
+        
+        Raises:
+            FileNotFoundError: If path does not exist
+        """
+        return _read_text(path)
+    
+    async def _transform_cached(
+        self,
+        code: str,
+        intent: str,
+        transform_type: TransformationType
+    ) -> TransformationResult:
+        """
+        Transform code, reusing a cached result for identical inputs.
+        
+        Results are keyed by SHA-256 of (transform type, intent, code) and
+        only successful transformations are stored.
+        """
+        key = hashlib.sha256(
+            f"{transform_type.name}|{intent}|{code}".encode("utf-8")
+        ).hexdigest()
+        cache_file = self.cache_dir / f"{key}.json"
+        
+        if self.use_cache:
+            try:
+                cached = json.loads(_read_text(str(cache_file)))
+                logger.info(f"Using cached transformation {key[:12]}")
+                return TransformationResult(
+                    success=True,
+                    original_code=code,
+                    transformed_code=cached["transformed_code"],
+                    transformation_type=transform_type,
+                    reasoning_steps=[
+                        ReasoningStep(**step) for step in cached["reasoning_steps"]
+                    ],
+                    validation_errors=cached["validation_errors"],
+                    confidence_score=cached["confidence_score"],
+                    explanation=cached["explanation"]
+                )
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        
+        result = await self.reasoner.transform_code(
+            code=code,
+            intent=intent,
+            transform_type=transform_type
+        )
+        
+        if self.use_cache and result.success:
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                _write_text(str(cache_file), json.dumps({
+                    "transformed_code": result.transformed_code,
+                    "confidence_score": result.confidence_score,
+                    "explanation": result.explanation,
+                    "validation_errors": result.validation_errors,
+                    "reasoning_steps": [
+                        {
+                            "step_num": s.step_num,
+                            "thought": s.thought,
+                            "action": s.action,
+                            "code_snippet": s.code_snippet,
+                            "confidence": s.confidence,
+                            "rationale": s.rationale
+                        }
+                        for s in result.reasoning_steps
+                    ],
+                }))
+            except OSError as e:
+                logger.warning(f"Could not write transformation cache: {e}")
+        
+        return result
     
     async def analyze(self, code_path: str, output_format: str = "markdown"):
         """Analyze code."""
         print(f"📊 Analyzing {code_path}...")
         
-        code = self.load_code(code_path)
-        analysis = self.analyzer.analyze(code)
+        code = await asyncio.to_thread(self.load_code, code_path)
+        analysis = await asyncio.to_thread(self.analyzer.analyze, code)
         
         if not analysis.get("success"):
             print(f"❌ Analysis failed: {analysis.get('error')}")
@@ -72,7 +229,7 @@ class JarvisoCLI:
         # Optionally save
         if output_format == "markdown":
             output_file = Path(code_path).stem + "_analysis.md"
-            Path(output_file).write_text(formatted)
+            await asyncio.to_thread(_write_text, output_file, formatted)
             print(f"\n✓ Analysis saved to {output_file}")
     
     async def transform(
@@ -83,43 +240,41 @@ class JarvisoCLI:
         output_file: Optional[str] = None
     ):
         """Transform code."""
-        print(f"🔄 Transforming code: {intent}")
-        print(f"   Type: {transform_type}")
+        sys.stdout.write(f"🔄 Transforming code: {intent}\n   Type: {transform_type}\n")
         
-        code = self.load_code(code_path)
-        transform_enum = TransformationType[transform_type.upper()]
+        code = await asyncio.to_thread(self.load_code, code_path)
+        transform_enum = _TRANSFORM_TYPES[transform_type]
         
-        result = await self.reasoner.transform_code(
-            code=code,
-            intent=intent,
-            transform_type=transform_enum
-        )
+        result = await self._transform_cached(code, intent, transform_enum)
         
-        print(f"\n✓ Transformation confidence: {result.confidence_score:.0%}")
+        out = [f"\n✓ Transformation confidence: {result.confidence_score:.0%}"]
         
         if result.success:
-            print(f"✓ Transformation successful")
-            print(f"\n## Reasoning:")
-            for step in result.reasoning_steps:
-                print(f"  Step {step.step_num}: {step.thought}")
+            out.append("✓ Transformation successful")
+            out.append("\n## Reasoning:")
+            out.extend(
+                f"  Step {step.step_num}: {step.thought}"
+                for step in result.reasoning_steps
+            )
             
-            print(f"\n## Transformed Code:")
-            print("```python")
-            print(result.transformed_code)
-            print("```")
+            out.append("\n## Transformed Code:")
+            out.append("```python")
+            out.append(result.transformed_code)
+            out.append("```")
             
             if output_file:
-                Path(output_file).write_text(result.transformed_code)
-                print(f"\n✓ Saved to {output_file}")
+                await asyncio.to_thread(_write_text, output_file, result.transformed_code)
+                out.append(f"\n✓ Saved to {output_file}")
             
             if result.validation_errors:
-                print(f"\n⚠️ Validation warnings:")
-                for error in result.validation_errors:
-                    print(f"  - {error}")
+                out.append("\n⚠️ Validation warnings:")
+                out.extend(f"  - {error}" for error in result.validation_errors)
         else:
-            print(f"❌ Transformation failed")
-            for error in result.validation_errors:
-                print(f"  - {error}")
+            out.append("❌ Transformation failed")
+            out.extend(f"  - {error}" for error in result.validation_errors)
+        
+        # One write keeps the report contiguous when several files run at once
+        sys.stdout.write("\n".join(out) + "\n")
     
     async def refactor(
         self,
@@ -143,8 +298,8 @@ class JarvisoCLI:
         """Generate documentation."""
         print(f"📚 Generating documentation for {code_path}...")
         
-        code = self.load_code(code_path)
-        analysis = self.analyzer.analyze(code)
+        code = await asyncio.to_thread(self.load_code, code_path)
+        analysis = await asyncio.to_thread(self.analyzer.analyze, code)
         
         if not analysis.get("success"):
             print(f"❌ Analysis failed")
@@ -159,7 +314,7 @@ class JarvisoCLI:
         
         # Save
         output_file = Path(code_path).stem + "_docs.md"
-        Path(output_file).write_text(doc)
+        await asyncio.to_thread(_write_text, output_file, doc)
         
         print(f"✓ Documentation saved to {output_file}")
     
@@ -167,8 +322,8 @@ class JarvisoCLI:
         """Generate analysis report."""
         print(f"📋 Generating report for {code_path}...")
         
-        code = self.load_code(code_path)
-        analysis = self.analyzer.analyze(code)
+        code = await asyncio.to_thread(self.load_code, code_path)
+        analysis = await asyncio.to_thread(self.analyzer.analyze, code)
         
         if not analysis.get("success"):
             print(f"❌ Analysis failed")
@@ -183,40 +338,68 @@ class JarvisoCLI:
         
         # Save
         output_file = Path(code_path).stem + "_report.md"
-        Path(output_file).write_text(report)
-        
-        print(f"✓ Report saved to {output_file}")
+        await asyncio.to_thread(_write_text, output_file, report)
         
-        # Print summary
+        # Print summary (one write, like transform)
         metrics = analysis.get("metrics", {})
-        print(f"\n## Summary:")
-        print(f"  Functions: {metrics.get('functions', 0)}")
-        print(f"  Classes: {metrics.get('classes', 0)}")
-        print(f"  Complexity: {analysis.get('complexity', 1)}/10")
-        print(f"  Issues: {len(analysis.get('issues', []))}")
+        sys.stdout.write("\n".join([
+            f"✓ Report saved to {output_file}",
+            "\n## Summary:",
+            f"  Functions: {metrics.get('functions', 0)}",
+            f"  Classes: {metrics.get('classes', 0)}",
+            f"  Complexity: {analysis.get('complexity', 1)}/10",
+            f"  Issues: {len(analysis.get('issues', []))}",
+        ]) + "\n")
     
     async def test(self, code_path: str):
         """Generate test cases."""
         print(f"🧪 Generating tests for {code_path}...")
         
-        code = self.load_code(code_path)
+        code = await asyncio.to_thread(self.load_code, code_path)
         
         # Use reasoner to generate tests
-        result = await self.reasoner.transform_code(
-            code=code,
-            intent="Create comprehensive test cases for this code",
-            transform_type=TransformationType.TEST
+        result = await self._transform_cached(
+            code,
+            "Create comprehensive test cases for this code",
+            TransformationType.TEST
         )
         
         if result.success:
             # Save tests
             output_file = Path(code_path).stem + "_test.py"
-            Path(output_file).write_text(result.transformed_code)
+            await asyncio.to_thread(_write_text, output_file, result.transformed_code)
             print(f"✓ Tests generated and saved to {output_file}")
         else:
             print(f"❌ Test generation failed")
 
 
+async def _run_for_each(
+    paths: List[str],
+    command: Callable[[str], Awaitable[None]]
+) -> int:
+    """
+    Run a CLI command over several files concurrently.
+    
+    A failure on one file does not stop the others.
+    
+    Returns:
+        Number of files the command failed on
+    """
+    results = await asyncio.gather(
+        *(command(path) for path in paths), return_exceptions=True
+    )
+    failures = 0
+    for path, outcome in zip(paths, results):
+        if isinstance(outcome, FileNotFoundError):
+            logger.error(f"File not found: {path}")
+        elif isinstance(outcome, Exception):
+            logger.error(f"Failed on {path}: {outcome}")
+        else:
+            continue
+        failures += 1
+    return failures
+
+
 def main():
     """Main entry point."""
     parser = argparse.ArgumentParser(
@@ -229,44 +412,49 @@ Examples:
   jarvisco refactor code.py --aspect performance
   jarvisco document code.py
   jarvisco report code.py
+  jarvisco report a.py b.py c.py
   jarvisco test code.py
         """
     )
     
     parser.add_argument("--version", action="version", version=f"JarvisCO {__version__}")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Ignore cached transformation results")
+    parser.add_argument("--quantization", choices=MistralLLM.QUANTIZATION_MODES, default="none",
+                        help="Load the model quantized (nf4 needs bitsandbytes)")
+    parser.add_argument("--small-model", choices=list(MistralLLM.SUPPORTED_MODELS),
+                        help="Smaller model for simple document/test transformations")
     
     subparsers = parser.add_subparsers(dest="command", help="Commands")
     
     # Analyze command
     analyze_parser = subparsers.add_parser("analyze", help="Analyze code")
-    analyze_parser.add_argument("code", help="Code file to analyze")
+    analyze_parser.add_argument("code", nargs="+", help="Code file(s) to analyze")
     analyze_parser.add_argument("--format", choices=["markdown", "html", "json"], default="markdown")
     
     # Transform command
     transform_parser = subparsers.add_parser("transform", help="Transform code")
-    transform_parser.add_argument("code", help="Code file to transform")
+    transform_parser.add_argument("code", nargs="+", help="Code file(s) to transform")
     transform_parser.add_argument("intent", help="Transformation intent (natural language)")
-    transform_parser.add_argument("--type", choices=[
-        "refactor", "generate", "optimize", "fix_bug", "add_feature", "document", "test", "migrate"
-    ], default="refactor")
+    transform_parser.add_argument("--type", choices=list(_TRANSFORM_TYPES), default="refactor")
     transform_parser.add_argument("--output", "-o", help="Output file")
     
     # Refactor command
     refactor_parser = subparsers.add_parser("refactor", help="Refactor code")
-    refactor_parser.add_argument("code", help="Code file to refactor")
+    refactor_parser.add_argument("code", nargs="+", help="Code file(s) to refactor")
     refactor_parser.add_argument("--aspect", choices=[
         "general", "performance", "async", "pythonic", "testing"
     ], default="general")
     refactor_parser.add_argument("--output", "-o", help="Output file")
     
     # Document command
-    subparsers.add_parser("document", help="Generate documentation").add_argument("code")
+    subparsers.add_parser("document", help="Generate documentation").add_argument("code", nargs="+")
     
     # Report command
-    subparsers.add_parser("report", help="Generate analysis report").add_argument("code")
+    subparsers.add_parser("report", help="Generate analysis report").add_argument("code", nargs="+")
     
     # Test command
-    subparsers.add_parser("test", help="Generate test cases").add_argument("code")
+    subparsers.add_parser("test", help="Generate test cases").add_argument("code", nargs="+")
     
     args = parser.parse_args()
     
@@ -274,22 +462,30 @@ Examples:
         parser.print_help()
         sys.exit(0)
     
-    cli = JarvisoCLI()
+    if getattr(args, "output", None) and len(args.code) > 1:
+        parser.error("--output can only be used with a single code file")
     
-    # Execute command
-    if args.command == "analyze":
-        asyncio.run(cli.analyze(args.code, args.format))
-    elif args.command == "transform":
-        asyncio.run(cli.transform(args.code, args.intent, args.type, args.output))
-    elif args.command == "refactor":
-        asyncio.run(cli.refactor(args.code, args.aspect, args.output))
-    elif args.command == "document":
-        asyncio.run(cli.document(args.code))
-    elif args.command == "report":
-        asyncio.run(cli.report(args.code))
-    elif args.command == "test":
-        asyncio.run(cli.test(args.code))
-
+    cli = JarvisoCLI(
+        use_cache=not args.no_cache,
+        quantization=args.quantization,
+        small_model=args.small_model
+    )
+    
+    commands = {
+        "analyze": lambda p: cli.analyze(p, args.format),
+        "transform": lambda p: cli.transform(p, args.intent, args.type, args.output),
+        "refactor": lambda p: cli.refactor(p, args.aspect, args.output),
+        "document": cli.document,
+        "report": cli.report,
+        "test": cli.test,
+    }
+    
+    if UVLOOP_AVAILABLE:
+        uvloop.install()
+    
+    # Execute command (all files concurrently) on a single event loop
+    if asyncio.run(_run_for_each(args.code, commands[args.command])):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
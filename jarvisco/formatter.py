@@ -16,11 +16,19 @@ Date: 2025-12-30
 
 import logging
 import json
+import time
+from datetime import datetime
 from typing import Dict, List, Any, Optional
 from dataclasses import asdict
 from pathlib import Path
 import jinja2
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 try:
     from rosaenlg import RosaENLG
     ROSAENLG_AVAILABLE = True
@@ -31,6 +39,74 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
+def _dumps(data: Any, indent: bool = False) -> str:
+    """Serialize to JSON, with orjson when it is installed."""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(data, default=str, option=option).decode("utf-8")
+    if indent:
+        return json.dumps(data, indent=2, default=str)
+    return json.dumps(data, separators=(",", ":"), default=str)
+
+
+# (epoch second, formatted timestamp); the format has one-second resolution
+_timestamp_cache = (-1, "")
+
+
+# Built-in templates live in jarvisco/templates/<name>.j2
+TEMPLATE_SUFFIX = ".j2"
+JINJA_CACHE_DIR = Path("~/.jarvisco/jinja_cache").expanduser()
+
+
+def _autoescape(template_name: Optional[str]) -> bool:
+    """HTML-escape only HTML templates; markdown must keep code verbatim."""
+    return template_name is not None and template_name.endswith("_html" + TEMPLATE_SUFFIX)
+
+
+class _LazyBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    Persist compiled templates across runs.
+    
+    The cache dir is created on the first dump rather than at import, and
+    the cache switches itself off if the directory is not writable.
+    """
+    
+    def __init__(self) -> None:
+        super().__init__(str(JINJA_CACHE_DIR))
+        self._disabled = False
+    
+    def load_bytecode(self, bucket: jinja2.bccache.Bucket) -> None:
+        if self._disabled:
+            return
+        try:
+            super().load_bytecode(bucket)
+        except OSError as e:
+            self._disable(e)
+    
+    def dump_bytecode(self, bucket: jinja2.bccache.Bucket) -> None:
+        if self._disabled:
+            return
+        try:
+            JINJA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            super().dump_bytecode(bucket)
+        except OSError as e:
+            self._disable(e)
+    
+    def _disable(self, error: OSError) -> None:
+        logger.debug(f"Jinja bytecode cache disabled: {error}")
+        self._disabled = True
+
+
+# Shared by every OutputFormatter; each template is compiled on first use
+# and then served from the environment's cache.
+_JINJA_ENV = jinja2.Environment(
+    loader=jinja2.PackageLoader("jarvisco", "templates"),
+    autoescape=_autoescape,
+    bytecode_cache=_LazyBytecodeCache(),
+    auto_reload=False
+)
+
+
 class OutputFormatter:
     """
     Formats code analysis and generation output using RosaENLG.
@@ -45,11 +121,16 @@ class OutputFormatter:
     def __init__(self):
         """Initialize formatter with templates."""
         self.rosaenlg_available = ROSAENLG_AVAILABLE
-        self.jinja_env = jinja2.Environment(
-            loader=jinja2.DictLoader(self._get_templates()),
-            autoescape=True
-        )
-        self.template_cache = {}
+        self.jinja_env = _JINJA_ENV
+        
+        # One engine per formatter; its linguistic resources load once
+        self._rosaenlg = None
+        if self.rosaenlg_available:
+            try:
+                self._rosaenlg = RosaENLG()
+            except Exception as e:
+                logger.warning(f"RosaENLG initialization failed: {e}, using Jinja2")
+                self.rosaenlg_available = False
     
     def format_code_documentation(
         self,
@@ -102,22 +183,25 @@ class OutputFormatter:
         """
         
         template_name = f"analysis_report_{style}"
+        issues = analysis_data.get("issues") or ()
         template_data = {
             "analysis": analysis_data,
+            "issues": issues,
             "include_issues": include_issues,
             "include_metrics": include_metrics,
             "timestamp": self._get_timestamp()
         }
         
         if include_issues:
-            template_data["critical_issues"] = [
-                i for i in analysis_data.get("issues", [])
-                if isinstance(i, dict) and i.get("severity") == "error"
-            ]
-            template_data["warnings"] = [
-                i for i in analysis_data.get("issues", [])
-                if isinstance(i, dict) and i.get("severity") == "warning"
-            ]
+            # Partition by severity in a single pass
+            buckets: Dict[str, List[Dict[str, Any]]] = {"error": [], "warning": []}
+            for issue in issues:
+                if isinstance(issue, dict):
+                    bucket = buckets.get(issue.get("severity"))
+                    if bucket is not None:
+                        bucket.append(issue)
+            template_data["critical_issues"] = buckets["error"]
+            template_data["warnings"] = buckets["warning"]
         
         if include_metrics:
             template_data["metrics"] = analysis_data.get("metrics", {})
@@ -141,9 +225,11 @@ class OutputFormatter:
         """
         
         template_name = f"transformation_report_{style}"
+        confidence = transformation_result.get("confidence_score")
         template_data = {
             "success": transformation_result.get("success"),
-            "confidence": transformation_result.get("confidence_score"),
+            "confidence": confidence,
+            "confidence_pct": int((confidence or 0) * 100),
             "explanation": transformation_result.get("explanation", ""),
             "reasoning_steps": transformation_result.get("reasoning_steps", []),
             "validation_errors": transformation_result.get("validation_errors", []),
@@ -171,10 +257,21 @@ class OutputFormatter:
         """
         
         template_name = f"test_documentation_{style}"
+        # Resolve defaults here so the template does plain key lookups
+        normalized = [
+            {
+                "name": t.get("name", ""),
+                "description": t.get("description") or "No description",
+                "inputs": t.get("inputs") or (),
+                "expected_result": t.get("expected_result") or "N/A",
+                "edge_cases": t.get("edge_cases") or ()
+            }
+            for t in test_cases
+        ]
         template_data = {
             "code": code,
-            "test_cases": test_cases,
-            "total_tests": len(test_cases),
+            "test_cases": normalized,
+            "total_tests": len(normalized),
             "timestamp": self._get_timestamp()
         }
         
@@ -189,200 +286,68 @@ class OutputFormatter:
                 return self._render_with_jinja2(template_name, data)
         except Exception as e:
             logger.error(f"Template rendering error: {e}")
-            return json.dumps(data, indent=2)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f"Template data for {template_name}: "
+                    f"{_dumps(data, indent=True)}"
+                )
+            return f"<!-- render failed: {e} -->"
     
     def _render_with_jinja2(self, template_name: str, data: Dict) -> str:
         """Render template using Jinja2 (fallback)."""
         try:
-            template = self.jinja_env.get_template(template_name)
-            return template.render(**data)
+            template = self.jinja_env.get_template(template_name + TEMPLATE_SUFFIX)
         except jinja2.TemplateNotFound:
             logger.warning(f"Template not found: {template_name}")
             return self._fallback_format(template_name, data)
+        return template.render(**data)
     
     def _render_with_rosaenlg(self, template_name: str, data: Dict) -> str:
         """Render template using RosaENLG."""
         try:
-            engine = RosaENLG()
             # RosaENLG rendering logic
             # (Would depend on RosaENLG API)
-            return engine.render(template_name, data)
+            return self._rosaenlg.render(template_name, data)
         except Exception as e:
             logger.warning(f"RosaENLG rendering failed: {e}, falling back to Jinja2")
             return self._render_with_jinja2(template_name, data)
     
-    def _get_templates(self) -> Dict[str, str]:
-        """Get built-in Jinja2 templates."""
-        return {
-            "code_documentation_markdown": """# {{ title }}
-
-## Overview
-Generated on {{ timestamp }}
-
-## Entities
-
-{% for entity_type, entities in entities.items() %}
-### {{ entity_type|title }}s
-{% for entity in entities %}
-- **{{ entity.name }}** (line {{ entity.line_start }}-{{ entity.line_end }})
-  {% if entity.docstring %}
-  > {{ entity.docstring }}
-  {% endif %}
-  {% if entity.parameters %}
-  - Parameters: {{ entity.parameters|join(', ') }}
-  {% endif %}
-  {% if entity.complexity and entity.complexity > 1 %}
-  - Complexity: {{ entity.complexity }}
-  {% endif %}
-{% endfor %}
-{% endfor %}
-
-## Metrics
-- Total Entities: {{ metrics.total_entities }}
-- Functions: {{ metrics.functions }}
-- Classes: {{ metrics.classes }}
-- Imports: {{ metrics.imports }}
-- Overall Complexity: {{ complexity }}/10
-
-## Code Quality
-{% if issues %}
-Found {{ issues|length }} issue(s):
-{% for issue in issues %}
-- **{{ issue.severity|upper }}** ({{ issue.category }}): {{ issue.message }} (line {{ issue.line }})
-  {% if issue.suggestion %}
-  → {{ issue.suggestion }}
-  {% endif %}
-{% endfor %}
-{% else %}
-✓ No major issues found
-{% endif %}
-""",
-
-            "analysis_report_markdown": """# Code Analysis Report
-
-Generated: {{ timestamp }}
-
-## Summary
-- **Files Analyzed**: 1
-- **Total Issues**: {{ analysis.issues|length if analysis.issues else 0 }}
-- **Complexity**: {{ analysis.complexity or 'N/A' }}
-
-## Issues
-{% if include_issues and critical_issues %}
-### Critical Issues ({{ critical_issues|length }})
-{% for issue in critical_issues %}
-- [{{ issue.line }}] {{ issue.message }}
-{% endfor %}
-{% endif %}
-
-{% if include_issues and warnings %}
-### Warnings ({{ warnings|length }})
-{% for issue in warnings %}
-- [{{ issue.line }}] {{ issue.message }}
-{% endfor %}
-{% endif %}
-
-## Metrics
-{% if include_metrics and metrics %}
-{% for key, value in metrics.items() %}
-- **{{ key }}**: {{ value }}
-{% endfor %}
-{% endif %}
-
-## Recommendations
-Based on the analysis, consider:
-1. Addressing critical issues first
-2. Refactoring high-complexity functions
-3. Adding documentation for public APIs
-4. Improving code organization
-""",
-
-            "transformation_report_markdown": """# Code Transformation Report
-
-Generated: {{ timestamp }}
-Status: {% if success %}✓ Success{% else %}✗ Failed{% endif %}
-Confidence: {{ confidence * 100|int }}%
-
-## Transformation Process
-
-{% for step in reasoning_steps %}
-### Step {{ step.step_num }}: {{ step.thought }}
-**Action**: {{ step.action }}
-{% if step.code_snippet %}
-```python
-{{ step.code_snippet }}
-```
-{% endif %}
-{% endfor %}
-
-## Result
-{{ explanation }}
-
-{% if validation_errors %}
-## Validation Issues
-{% for error in validation_errors %}
-- ⚠️ {{ error }}
-{% endfor %}
-{% else %}
-## Validation
-✓ Code passed all validation checks
-{% endif %}
-""",
-
-            "test_documentation_markdown": """# Test Documentation
-
-Total Tests: {{ total_tests }}
-Generated: {{ timestamp }}
-
-## Test Cases
-
-{% for test_case in test_cases %}
-### {{ test_case.name }}
-**Description**: {{ test_case.description or 'No description' }}
-
-{% if test_case.inputs %}
-**Inputs**:
-{% for input in test_case.inputs %}
-- `{{ input.name }}`: {{ input.type }}
-{% endfor %}
-{% endif %}
-
-**Expected Result**: {{ test_case.expected_result or 'N/A' }}
-
-{% if test_case.edge_cases %}
-**Edge Cases**:
-{% for edge_case in test_case.edge_cases %}
-- {{ edge_case }}
-{% endfor %}
-{% endif %}
----
-{% endfor %}
-"""
-        }
-    
     def _fallback_format(self, template_name: str, data: Dict) -> str:
         """Fallback formatting when templates not found."""
+        payload = _dumps(data)
         if "markdown" in template_name:
-            return f"# Output\n\n```json\n{json.dumps(data, indent=2)}\n```"
+            return f"# Output\n\n```json\n{payload}\n```"
         else:
-            return json.dumps(data, indent=2)
+            return payload
     
     @staticmethod
     def _get_timestamp() -> str:
-        """Get current timestamp."""
-        from datetime import datetime
-        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        """Get current timestamp, formatted at most once per second."""
+        global _timestamp_cache
+        now = int(time.time())
+        if _timestamp_cache[0] != now:
+            _timestamp_cache = (now, datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"))
+        return _timestamp_cache[1]
 
 
 # Convenience functions
 
+_default_formatter: Optional[OutputFormatter] = None
+
+
+def _get_default_formatter() -> OutputFormatter:
+    """Get the formatter shared by the convenience functions."""
+    global _default_formatter
+    if _default_formatter is None:
+        _default_formatter = OutputFormatter()
+    return _default_formatter
+
+
 def format_code_analysis(analysis: Dict[str, Any]) -> str:
     """Quick function to format code analysis."""
-    formatter = OutputFormatter()
-    return formatter.format_code_documentation(analysis)
+    return _get_default_formatter().format_code_documentation(analysis)
 
 
 def format_report(analysis: Dict[str, Any]) -> str:
     """Quick function to generate analysis report."""
-    formatter = OutputFormatter()
-    return formatter.format_analysis_report(analysis)
+    return _get_default_formatter().format_analysis_report(analysis)
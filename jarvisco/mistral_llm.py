@@ -9,22 +9,60 @@ Author: JarvisCO
 Date: 2025-12-30
 """
 
+from __future__ import annotations
+
 import os
+import asyncio
+import copy
+import hashlib
+import importlib.util
 import logging
 import json
 from typing import Optional, Generator, Dict, List, Any, Tuple
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field, fields
+import re
+import threading
 import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# torch/transformers take seconds to import, so they are bound on first
+# MistralLLM construction; the dataclasses below do not need them.
+torch = None
+AutoTokenizer = AutoModelForCausalLM = TextIteratorStreamer = None
+
+
+def _lazy_import_transformers() -> None:
+    """Import torch and transformers into module globals on first use."""
+    global torch, AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
+    if torch is not None:
+        return
+    try:
+        from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
+        import torch
+    except ImportError as e:
+        raise ImportError(
+            f"Required dependencies not found: {e}. "
+            "Please install: pip install transformers torch"
+        )
 
 try:
-    from transformers import AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer
-    from threading import Thread
-    import torch
-except ImportError as e:
-    raise ImportError(
-        f"Required dependencies not found: {e}. "
-        "Please install: pip install transformers torch"
-    )
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
 
 
 # Configure logging
@@ -39,11 +77,137 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# Keyword fallback for intent detection, in priority order
+_INTENT_KEYWORDS = {
+    "help": ["help", "assist", "support"],
+    "generate": ["generate", "create", "write", "produce"],
+    "analyze": ["analyze", "examine", "review"],
+    "summarize": ["summarize", "summary", "brief"],
+    "translate": ["translate", "translation"],
+    "explain": ["explain", "clarify", "elaborate"],
+}
+_INTENT_PRIORITY = {intent: i for i, intent in enumerate(_INTENT_KEYWORDS)}
+
+# Constant head of the intent-analysis prompt; its KV cache is reused
+_INTENT_PROMPT_PREFIX = """Analyze the following user text and provide:
+1. Primary intent (single word or short phrase)
+2. Confidence level (0-1)
+3. Any secondary intents
+4. Key entities mentioned
+5. Sentiment (positive/negative/neutral)
+6. Whether action is required
+
+"""
+
+
+def _build_intent_matcher():
+    """Build a single-pass keyword matcher over all intents."""
+    if AHOCORASICK_AVAILABLE:
+        automaton = ahocorasick.Automaton()
+        for intent, keywords in _INTENT_KEYWORDS.items():
+            for kw in keywords:
+                automaton.add_word(kw, intent)
+        automaton.make_automaton()
+        return lambda text: {intent for _, intent in automaton.iter(text)}
+    
+    # Zero-width lookahead so overlapping keywords are all reported
+    keyword_intent = {
+        kw: intent for intent, keywords in _INTENT_KEYWORDS.items() for kw in keywords
+    }
+    pattern = re.compile(
+        "(?=(" + "|".join(map(re.escape, keyword_intent)) + "))"
+    )
+    return lambda text: {keyword_intent[m.group(1)] for m in pattern.finditer(text)}
+
+
+_match_intents = _build_intent_matcher()
+
+_json_loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+
+_FP8_LINEAR = None
+
+
+def _fp8_linear_class():
+    """Build (once, after torch is imported) the fp8 replacement for nn.Linear."""
+    global _FP8_LINEAR
+    if _FP8_LINEAR is not None:
+        return _FP8_LINEAR
+    
+    fp8 = torch.float8_e4m3fn
+    fp8_max = torch.finfo(fp8).max
+    
+    class FP8Linear(torch.nn.Module):
+        """nn.Linear with per-tensor scaled fp8 weights, computed via torch._scaled_mm."""
+        
+        def __init__(self, linear: torch.nn.Linear):
+            super().__init__()
+            weight = linear.weight.detach()
+            scale = weight.abs().amax().float().clamp(min=1e-12) / fp8_max
+            self.register_buffer("weight_fp8", (weight / scale).to(fp8))
+            self.register_buffer("weight_scale", scale)
+            self.bias = linear.bias
+            self.out_dtype = weight.dtype
+        
+        def forward(self, x: torch.Tensor) -> torch.Tensor:
+            shape = x.shape
+            x2d = x.reshape(-1, shape[-1])
+            x_scale = x2d.abs().amax().float().clamp(min=1e-12) / fp8_max
+            try:
+                out = torch._scaled_mm(
+                    (x2d / x_scale).to(fp8),
+                    self.weight_fp8.t(),
+                    scale_a=x_scale,
+                    scale_b=self.weight_scale,
+                    bias=self.bias,
+                    out_dtype=self.out_dtype,
+                )
+                # Older PyTorch returns (out, amax)
+                if isinstance(out, tuple):
+                    out = out[0]
+            except RuntimeError:
+                # Shapes _scaled_mm cannot tile (e.g. odd token counts)
+                weight = self.weight_fp8.to(self.out_dtype) * self.weight_scale.to(self.out_dtype)
+                out = torch.nn.functional.linear(x2d.to(self.out_dtype), weight, self.bias)
+            return out.reshape(*shape[:-1], out.shape[-1])
+    
+    _FP8_LINEAR = FP8Linear
+    return _FP8_LINEAR
+
+
+def _find_json_object(text: str) -> Optional[str]:
+    """Return the first balanced {...} object in text, scanning it once."""
+    start = text.find("{")
+    if start < 0:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == "{":
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+
 @dataclass
 class GenerationParameters:
     """Data class for managing text generation parameters."""
     
     max_length: int = 512
+    max_new_tokens: Optional[int] = 256  # takes precedence over max_length
     min_length: int = 1
     temperature: float = 0.7
     top_p: float = 0.9
@@ -56,27 +220,26 @@ class GenerationParameters:
     no_repeat_ngram_size: int = 0
     pad_token_id: Optional[int] = None
     eos_token_id: Optional[int] = None
+    use_cache: bool = True
+    
+    def validation_errors(self) -> List[str]:
+        """Return every range violation (empty when all parameters are valid)."""
+        return [message for check, message in _GENERATION_RULES if not check(self)]
     
     def validate(self) -> bool:
-        """Validate parameter ranges."""
-        validations = [
-            (0 < self.temperature <= 2.0, "temperature must be between 0 and 2.0"),
-            (0 <= self.top_p <= 1.0, "top_p must be between 0 and 1.0"),
-            (0 < self.top_k <= 100, "top_k must be between 0 and 100"),
-            (0 < self.repetition_penalty <= 2.0, "repetition_penalty must be between 0 and 2.0"),
-            (self.max_length > self.min_length, "max_length must be greater than min_length"),
-            (self.num_beams >= 1, "num_beams must be at least 1"),
-        ]
-        
-        for condition, message in validations:
-            if not condition:
-                logger.warning(f"Parameter validation warning: {message}")
-                return False
-        return True
+        """Validate parameter ranges, logging each violation."""
+        if self.num_beams > 1 and self.do_sample:
+            logger.warning(_BEAM_SAMPLE_WARNING)
+            self.do_sample = False
+        errors = self.validation_errors()
+        for message in errors:
+            logger.warning(f"Parameter validation warning: {message}")
+        return not errors
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert parameters to dictionary."""
-        return asdict(self)
+        # Shallow field copy; asdict's recursive deepcopy is wasted on scalars
+        return {name: getattr(self, name) for name in _GENERATION_FIELDS}
 
 
 @dataclass
@@ -93,7 +256,37 @@ class IntentAnalysis:
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary."""
-        return asdict(self)
+        return {
+            "primary_intent": self.primary_intent,
+            "confidence": self.confidence,
+            "secondary_intents": list(self.secondary_intents),
+            "entities": dict(self.entities),
+            "sentiment": self.sentiment,
+            "requires_action": self.requires_action,
+            "action_type": self.action_type,
+        }
+
+
+_GENERATION_FIELDS = tuple(f.name for f in fields(GenerationParameters))
+
+# (check, message) pairs evaluated by GenerationParameters.validation_errors
+_GENERATION_RULES = (
+    (lambda p: 0 < p.temperature <= 2.0, "temperature must be between 0 and 2.0"),
+    (lambda p: 0 <= p.top_p <= 1.0, "top_p must be between 0 and 1.0"),
+    (lambda p: 0 < p.top_k <= 100, "top_k must be between 0 and 100"),
+    (lambda p: 0 < p.repetition_penalty <= 2.0, "repetition_penalty must be between 0 and 2.0"),
+    (lambda p: p.max_length > p.min_length, "max_length must be greater than min_length"),
+    (lambda p: p.max_new_tokens is None or p.max_new_tokens > 0,
+     "max_new_tokens must be positive"),
+    (lambda p: p.num_beams >= 1, "num_beams must be at least 1"),
+    (lambda p: p.num_beams == 1 or p.early_stopping,
+     "beam search without early_stopping wastes compute"),
+)
+
+_BEAM_SAMPLE_WARNING = (
+    "beam search with sampling (beam-sample) is extremely slow; "
+    "setting do_sample=False because num_beams > 1"
+)
 
 
 class MistralLLM:
@@ -114,16 +307,35 @@ class MistralLLM:
         "mistral-7b": "mistralai/Mistral-7B-v0.1",
         "mistral-7b-instruct": "mistralai/Mistral-7B-Instruct-v0.1",
         "mistral-7b-instruct-v2": "mistralai/Mistral-7B-Instruct-v0.2",
+        # Small instruct model for routing simple tasks
+        "qwen2.5-1.5b-instruct": "Qwen/Qwen2.5-1.5B-Instruct",
     }
     
+    # Quantization schemes; gptq/awq come from pre-quantized checkpoints
+    QUANTIZATION_MODES = ("none", "nf4", "gptq", "awq")
+    
+    # Tokenized prompts shorter than this are kept for reuse
+    PROMPT_CACHE_MAX_CHARS = 2048
+    PROMPT_CACHE_SIZE = 128
+    
+    # Completions of deterministic (non-sampling) generate() calls
+    RESPONSE_CACHE_SIZE = 1024
+    
+    # KV caches of shared prompt prefixes (see generate(prefix=...))
+    PREFIX_KV_CACHE_SIZE = 4
+    
     def __init__(
         self,
         model_name: str = "mistral-7b-instruct",
         device: str = "auto",
-        dtype: str = "float16",
+        dtype: str = "auto",
         cache_dir: Optional[str] = None,
         load_in_8bit: bool = False,
         load_in_4bit: bool = False,
+        quantization: str = "none",
+        compile_model: bool = True,
+        compile_mode: str = "reduce-overhead",
+        response_cache_dir: Optional[str] = "~/.jarvisco/llm_cache",
     ):
         """
         Initialize Mistral 7B model.
@@ -131,23 +343,45 @@ class MistralLLM:
         Args:
             model_name: Name or path of the model variant
             device: Device to load model on ('cuda', 'cpu', 'auto')
-            dtype: Data type for model ('float16', 'float32', 'bfloat16')
+            dtype: Data type for model ('auto', 'float16', 'float32', 'bfloat16',
+                'fp8'). 'auto' picks bfloat16 on GPUs that support it and
+                float16 otherwise; explicit types are used as given. 'fp8' loads in bfloat16 and runs linear layers as fp8 matmuls
+                on Ada/Hopper GPUs, falling back to bfloat16 elsewhere
             cache_dir: Directory to cache downloaded models
-            load_in_8bit: Enable 8-bit quantization
-            load_in_4bit: Enable 4-bit quantization
+            load_in_8bit: Enable bitsandbytes 8-bit quantization (usually slower
+                than fp16 for inference; prefer load_in_4bit)
+            load_in_4bit: Enable 4-bit NF4 quantization (recommended)
+            quantization: One of 'none', 'nf4', 'gptq', 'awq'. 'nf4' is the same
+                as load_in_4bit; 'gptq'/'awq' expect a pre-quantized checkpoint
+            compile_model: Compile the forward pass with torch.compile (CUDA only)
+            compile_mode: torch.compile mode used when compile_model is set
+            response_cache_dir: Directory for the persistent cache of
+                deterministic completions (requires diskcache; None disables)
         
         Raises:
-            ValueError: If model name is not supported
+            ValueError: If model name or quantization mode is not supported
             RuntimeError: If model loading fails
         """
         logger.info(f"Initializing Mistral 7B model: {model_name}")
         
+        _lazy_import_transformers()
+        
         self.model_name = model_name
         self.device = self._resolve_device(device)
+        self.device_map = self._resolve_device_map(device)
+        self.use_fp8 = dtype == "fp8"
         self.dtype = self._resolve_dtype(dtype)
         self.cache_dir = cache_dir
+        if quantization not in self.QUANTIZATION_MODES:
+            raise ValueError(
+                f"Quantization '{quantization}' not supported. "
+                f"Supported modes: {list(self.QUANTIZATION_MODES)}"
+            )
+        self.quantization = quantization
         self.load_in_8bit = load_in_8bit
-        self.load_in_4bit = load_in_4bit
+        self.load_in_4bit = load_in_4bit or quantization == "nf4"
+        self.compile_model = compile_model
+        self.compile_mode = compile_mode
         
         # Validate model name
         if model_name not in self.SUPPORTED_MODELS and not os.path.exists(model_name):
@@ -163,10 +397,28 @@ class MistralLLM:
         self.tokenizer: Optional[AutoTokenizer] = None
         self.model: Optional[AutoModelForCausalLM] = None
         self.generation_params = GenerationParameters()
+        self._prompt_cache: "OrderedDict[str, Dict[str, torch.Tensor]]" = OrderedDict()
+        self._prompt_cache_lock = threading.Lock()
+        self._response_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+        self._disk_cache = self._open_disk_cache(response_cache_dir)
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._copy_stream: Optional["torch.cuda.Stream"] = None
+        self._prefix_kv_cache: "OrderedDict[str, Tuple[torch.Tensor, Any]]" = OrderedDict()
+        self._prefix_kv_lock = threading.Lock()
+        self.attn_implementation: Optional[str] = None
+        # One HF model is not safe to run from several threads at once
+        # (memory, torch.compile state); concurrent callers queue here
+        self._generate_lock = threading.Lock()
+        # Persistent worker for streaming generation
+        self._gen_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mistral-gen")
         
         try:
             self._load_model()
             logger.info(f"Successfully loaded model: {self.model_name}")
+            if self.compile_model and self.device == "cuda":
+                self._compile_model()
         except Exception as e:
             logger.error(f"Failed to load model: {str(e)}")
             raise RuntimeError(f"Model loading failed: {str(e)}") from e
@@ -180,12 +432,34 @@ class MistralLLM:
             return "cpu"
         return device
     
+    def _resolve_device_map(self, device: str) -> str:
+        """Let accelerate place weights directly when the device is 'auto'."""
+        if device != "auto":
+            return self.device
+        torch_major = int(torch.__version__.split(".")[0])
+        if torch_major < 2 or importlib.util.find_spec("accelerate") is None:
+            return self.device
+        return "auto"
+    
     def _resolve_dtype(self, dtype: str) -> torch.dtype:
-        """Resolve data type."""
+        """Resolve data type ("auto": bfloat16 on GPUs that support it, else float16)."""
+        if dtype == "auto":
+            # Same tensor-core throughput on Ampere+, but no fp16 overflow handling
+            if (
+                self.device == "cuda"
+                and torch.cuda.is_available()
+                and torch.cuda.is_bf16_supported()
+            ):
+                logger.info("GPU supports bfloat16, using it")
+                return torch.bfloat16
+            return torch.float16
+        
         dtype_map = {
             "float16": torch.float16,
             "float32": torch.float32,
             "bfloat16": torch.bfloat16,
+            # Weights are loaded in bf16 and converted after loading
+            "fp8": torch.bfloat16,
         }
         return dtype_map.get(dtype, torch.float16)
     
@@ -203,13 +477,18 @@ class MistralLLM:
         if self.tokenizer.pad_token is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
         
+        # Left padding keeps batched prompts aligned for causal decoding
+        self.tokenizer.padding_side = "left"
+        
         # Load model
         logger.info(f"Loading model from {self.model_path}")
         
         model_kwargs = {
             "cache_dir": self.cache_dir,
             "trust_remote_code": True,
-            "device_map": self.device,
+            "device_map": self.device_map,
+            # Stream (mmap'd safetensors) weights into place shard by shard
+            "low_cpu_mem_usage": True,
         }
         
         if self.dtype == torch.float16:
@@ -217,14 +496,28 @@ class MistralLLM:
         elif self.dtype == torch.bfloat16:
             model_kwargs["torch_dtype"] = torch.bfloat16
         
-        if self.load_in_8bit or self.load_in_4bit:
+        if self.quantization in ("gptq", "awq"):
+            # transformers picks up the quantization config from the checkpoint
+            logger.info(f"Loading pre-quantized {self.quantization.upper()} checkpoint")
+        elif self.load_in_8bit or self.load_in_4bit:
+            if self.load_in_8bit and not self.load_in_4bit:
+                logger.warning(
+                    "bitsandbytes int8 is typically slower than fp16 for 7B inference; "
+                    "prefer load_in_4bit=True or a pre-quantized GPTQ/AWQ checkpoint"
+                )
             try:
                 from transformers import BitsAndBytesConfig
                 
                 if self.load_in_4bit:
+                    # bf16 matmuls are faster than fp16 on Ampere and newer
+                    compute_dtype = (
+                        torch.bfloat16
+                        if torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+                        else torch.float16
+                    )
                     model_kwargs["quantization_config"] = BitsAndBytesConfig(
                         load_in_4bit=True,
-                        bnb_4bit_compute_dtype=torch.float16,
+                        bnb_4bit_compute_dtype=compute_dtype,
                         bnb_4bit_use_double_quant=True,
                         bnb_4bit_quant_type="nf4",
                     )
@@ -233,12 +526,239 @@ class MistralLLM:
             except ImportError:
                 logger.warning("bitsandbytes not available, loading without quantization")
         
-        self.model = AutoModelForCausalLM.from_pretrained(
+        self.model = self._from_pretrained_with_attention(model_kwargs)
+        
+        self.model.eval()
+        
+        if self.use_fp8:
+            self._apply_fp8()
+        
+        # Parameter counts never change after loading
+        self._total_params = 0
+        self._trainable_params = 0
+        for p in self.model.parameters():
+            n = p.numel()
+            self._total_params += n
+            if p.requires_grad:
+                self._trainable_params += n
+        
+        # Side stream for host-to-device prompt copies in streaming generation
+        if self.device == "cuda":
+            self._copy_stream = torch.cuda.Stream()
+    
+    def _apply_fp8(self) -> None:
+        """Swap linear layers for fp8 scaled-matmul layers on supported GPUs."""
+        supported = (
+            self.device == "cuda"
+            and not (self.load_in_8bit or self.load_in_4bit)
+            and self.quantization == "none"
+            and hasattr(torch, "float8_e4m3fn")
+            and hasattr(torch, "_scaled_mm")
+            and torch.cuda.get_device_capability() >= (8, 9)
+        )
+        if not supported:
+            logger.warning("fp8 matmuls need an unquantized model on an Ada/Hopper GPU; using bfloat16")
+            self.use_fp8 = False
+            return
+        
+        fp8_linear = _fp8_linear_class()
+        replaced = 0
+        for module in list(self.model.modules()):
+            for name, child in list(module.named_children()):
+                # Keep the output projection in bf16 for logit precision
+                if isinstance(child, torch.nn.Linear) and name != "lm_head":
+                    setattr(module, name, fp8_linear(child))
+                    replaced += 1
+        logger.info(f"Converted {replaced} linear layers to fp8")
+    
+    def _attention_candidates(self) -> List[str]:
+        """Fused attention backends to try, fastest first."""
+        candidates = []
+        if (
+            self.device == "cuda"
+            and self.dtype in (torch.float16, torch.bfloat16)
+            and importlib.util.find_spec("flash_attn") is not None
+        ):
+            candidates.append("flash_attention_2")
+        candidates.append("sdpa")
+        return candidates
+    
+    def _from_pretrained_with_attention(self, model_kwargs: Dict[str, Any]) -> Any:
+        """Load the model with the fastest attention backend that works."""
+        for attn_implementation in self._attention_candidates():
+            try:
+                model = AutoModelForCausalLM.from_pretrained(
+                    self.model_path,
+                    attn_implementation=attn_implementation,
+                    **model_kwargs
+                )
+                self.attn_implementation = attn_implementation
+                logger.info(f"Using attention backend: {attn_implementation}")
+                return model
+            except (ImportError, ValueError, TypeError) as e:
+                logger.warning(f"Attention backend '{attn_implementation}' unavailable: {str(e)}")
+        
+        # Let transformers pick its default implementation
+        model = AutoModelForCausalLM.from_pretrained(
             self.model_path,
             **model_kwargs
         )
+        self.attn_implementation = getattr(model.config, "_attn_implementation", "eager")
+        return model
+    
+    def _compile_model(self) -> None:
+        """Compile the forward pass and trigger compilation with a short warmup."""
+        if not hasattr(torch, "compile"):
+            logger.warning("torch.compile requires PyTorch 2.0+, running in eager mode")
+            return
+        
+        # Persist Inductor artifacts so later processes skip most compile time
+        if self.cache_dir:
+            os.environ.setdefault(
+                "TORCHINDUCTOR_CACHE_DIR",
+                os.path.join(self.cache_dir, "torchinductor")
+            )
         
-        self.model.eval()
+        eager_forward = self.model.forward
+        try:
+            self.model.forward = torch.compile(
+                eager_forward,
+                mode=self.compile_mode,
+                fullgraph=False,
+                dynamic=True,
+            )
+            inputs = self.tokenizer("Hello", return_tensors="pt").to(self.device)
+            with torch.inference_mode():
+                self.model.generate(
+                    **inputs,
+                    max_new_tokens=4,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                )
+            logger.info(f"Compiled model forward (mode={self.compile_mode})")
+        except Exception as e:
+            logger.warning(f"torch.compile failed, running in eager mode: {str(e)}")
+            self.model.forward = eager_forward
+    
+    def _encode(self, prompt: str) -> Dict[str, torch.Tensor]:
+        """
+        Tokenize a prompt onto the model device.
+        
+        Returns input_ids and attention_mask. Encodings of short prompts are
+        cached; on CUDA they are held in pinned memory so the device copy
+        runs asynchronously.
+        """
+        cacheable = len(prompt) < self.PROMPT_CACHE_MAX_CHARS
+        enc = None
+        if cacheable:
+            with self._prompt_cache_lock:
+                enc = self._prompt_cache.get(prompt)
+                if enc is not None:
+                    self._prompt_cache.move_to_end(prompt)
+        if enc is None:
+            enc = dict(self.tokenizer(prompt, return_tensors="pt"))
+            if self.device == "cuda":
+                enc = {k: v.pin_memory() for k, v in enc.items()}
+            if cacheable:
+                # generate() may be called from several threads at once
+                with self._prompt_cache_lock:
+                    self._prompt_cache[prompt] = enc
+                    if len(self._prompt_cache) > self.PROMPT_CACHE_SIZE:
+                        self._prompt_cache.popitem(last=False)
+        return {k: v.to(self.device, non_blocking=True) for k, v in enc.items()}
+    
+    def _prepare_gen_params(self, overrides: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Merge per-call overrides into the default generation parameters.
+        
+        An explicit max_length override keeps its absolute meaning; otherwise
+        max_new_tokens, when set, replaces the absolute max_length limit.
+        """
+        gen_params = self.generation_params.to_dict()
+        if overrides.get("max_length") is not None and "max_new_tokens" not in overrides:
+            gen_params["max_new_tokens"] = None
+        gen_params.update(overrides)
+        
+        if gen_params.get("num_beams", 1) > 1 and gen_params.get("do_sample"):
+            logger.warning(_BEAM_SAMPLE_WARNING)
+            gen_params["do_sample"] = False
+        
+        if gen_params.get("max_new_tokens") is not None:
+            gen_params.pop("max_length", None)
+        else:
+            gen_params.pop("max_new_tokens", None)
+        return gen_params
+    
+    def _response_cache_key(self, prompt: str, gen_params: Dict[str, Any]) -> str:
+        """Digest of the model and its precision, a prompt and its decoding parameters."""
+        # past_key_values only skips prefill work, it does not change the output
+        params = sorted(
+            (k, repr(v)) for k, v in gen_params.items() if k != "past_key_values"
+        )
+        # The same checkpoint gives different outputs at another precision
+        precision = (
+            self.quantization, str(self.dtype),
+            self.use_fp8, self.load_in_8bit, self.load_in_4bit
+        )
+        h = hashlib.blake2b(self.model_path.encode("utf-8"), digest_size=16)
+        h.update(repr(precision).encode("utf-8"))
+        h.update(prompt.encode("utf-8"))
+        h.update(repr(params).encode("utf-8"))
+        return h.hexdigest()
+    
+    @staticmethod
+    def _open_disk_cache(directory: Optional[str]) -> Optional[Any]:
+        """Open the persistent response cache, if enabled and available."""
+        if directory is None or not DISKCACHE_AVAILABLE:
+            return None
+        try:
+            return diskcache.Cache(os.path.expanduser(directory))
+        except Exception as e:
+            logger.warning(f"Persistent response cache disabled: {str(e)}")
+            return None
+    
+    def _lookup_response(self, key: str) -> Optional[str]:
+        """Find a cached completion in memory, then on disk."""
+        with self._response_cache_lock:
+            cached = self._response_cache.get(key)
+            if cached is not None:
+                self._response_cache.move_to_end(key)
+                self._cache_hits += 1
+                return cached
+        
+        if self._disk_cache is not None:
+            cached = self._disk_cache.get(key)
+            if cached is not None:
+                self._store_response(key, cached, persist=False)
+                with self._response_cache_lock:
+                    self._cache_hits += 1
+                return cached
+        
+        with self._response_cache_lock:
+            self._cache_misses += 1
+        return None
+    
+    def _store_response(self, key: str, text: str, persist: bool = True) -> None:
+        """Remember a completion in memory and, optionally, on disk."""
+        with self._response_cache_lock:
+            self._response_cache[key] = text
+            if len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+        if persist and self._disk_cache is not None:
+            self._disk_cache.set(key, text)
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for the deterministic response cache."""
+        with self._response_cache_lock:
+            hits, misses = self._cache_hits, self._cache_misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._response_cache),
+            "persistent": self._disk_cache is not None,
+            "disk_entries": len(self._disk_cache) if self._disk_cache is not None else 0,
+        }
     
     def update_generation_params(self, **kwargs) -> None:
         """
@@ -250,13 +770,24 @@ class MistralLLM:
         Raises:
             ValueError: If invalid parameter name
         """
-        for key, value in kwargs.items():
+        for key in kwargs:
             if not hasattr(self.generation_params, key):
                 raise ValueError(f"Unknown parameter: {key}")
+        
+        # Setting an absolute max_length opts out of the new-token budget
+        if "max_length" in kwargs and "max_new_tokens" not in kwargs:
+            kwargs["max_new_tokens"] = None
+        
+        changed = False
+        for key, value in kwargs.items():
+            if getattr(self.generation_params, key) == value:
+                continue
             setattr(self.generation_params, key, value)
+            changed = True
             logger.debug(f"Updated parameter {key} to {value}")
         
-        if not self.generation_params.validate():
+        # Parameters were valid (or already reported) before this call
+        if changed and not self.generation_params.validate():
             logger.warning("Some parameters are outside recommended ranges")
     
     def get_generation_params(self) -> Dict[str, Any]:
@@ -270,6 +801,7 @@ class MistralLLM:
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
         top_k: Optional[int] = None,
+        prefix: Optional[str] = None,
         **kwargs
     ) -> str:
         """
@@ -277,10 +809,13 @@ class MistralLLM:
         
         Args:
             prompt: Input text prompt
-            max_length: Maximum length of generated text (overrides default)
+            max_length: Maximum total length, prompt included (overrides default;
+                ignored when max_new_tokens is passed)
             temperature: Sampling temperature (overrides default)
             top_p: Nucleus sampling parameter (overrides default)
             top_k: Top-k sampling parameter (overrides default)
+            prefix: Leading part of prompt shared with other calls; its KV
+                cache is computed once and reused to skip that prefill
             **kwargs: Additional generation parameters
         
         Returns:
@@ -297,26 +832,40 @@ class MistralLLM:
         
         try:
             # Prepare generation parameters
-            gen_params = self.generation_params.to_dict()
-            
+            overrides = {}
             if max_length is not None:
-                gen_params["max_length"] = max_length
+                overrides["max_length"] = max_length
             if temperature is not None:
-                gen_params["temperature"] = temperature
+                overrides["temperature"] = temperature
             if top_p is not None:
-                gen_params["top_p"] = top_p
+                overrides["top_p"] = top_p
             if top_k is not None:
-                gen_params["top_k"] = top_k
+                overrides["top_k"] = top_k
+            
+            overrides.update(kwargs)
+            gen_params = self._prepare_gen_params(overrides)
             
-            gen_params.update(kwargs)
+            # Sampled outputs are meant to vary, so only greedy/beam results are reused
+            cache_key = None
+            if not gen_params.get("do_sample"):
+                cache_key = self._response_cache_key(prompt, gen_params)
+                cached = self._lookup_response(cache_key)
+                if cached is not None:
+                    logger.debug("Returning cached generation")
+                    return cached
+            
+            if prefix and "past_key_values" not in gen_params:
+                prefix_kv = self._prefix_kv(prefix, prompt)
+                if prefix_kv is not None:
+                    gen_params["past_key_values"] = prefix_kv
             
             # Tokenize input
-            inputs = self.tokenizer.encode(prompt, return_tensors="pt").to(self.device)
+            inputs = self._encode(prompt)
             
             # Generate
-            with torch.no_grad():
+            with self._generate_lock, torch.inference_mode():
                 outputs = self.model.generate(
-                    inputs,
+                    **inputs,
                     **gen_params
                 )
             
@@ -326,6 +875,9 @@ class MistralLLM:
                 skip_special_tokens=True
             )
             
+            if cache_key is not None:
+                self._store_response(cache_key, generated_text)
+            
             logger.debug(f"Generation successful")
             return generated_text
         
@@ -333,6 +885,10 @@ class MistralLLM:
             logger.error(f"Text generation failed: {str(e)}")
             raise RuntimeError(f"Generation failed: {str(e)}") from e
     
+    async def agenerate(self, prompt: str, **kwargs) -> str:
+        """Run generate() in a worker thread, off the event loop."""
+        return await asyncio.to_thread(self.generate, prompt, **kwargs)
+    
     def generate_streaming(
         self,
         prompt: str,
@@ -363,15 +919,14 @@ class MistralLLM:
         
         try:
             # Prepare generation parameters
-            gen_params = self.generation_params.to_dict()
-            gen_params["do_sample"] = True
-            
+            overrides = {"do_sample": True}
             if max_length is not None:
-                gen_params["max_length"] = max_length
+                overrides["max_length"] = max_length
             if temperature is not None:
-                gen_params["temperature"] = temperature
+                overrides["temperature"] = temperature
             
-            gen_params.update(kwargs)
+            overrides.update(kwargs)
+            gen_params = self._prepare_gen_params(overrides)
             
             # Setup streamer
             streamer = TextIteratorStreamer(
@@ -379,30 +934,57 @@ class MistralLLM:
                 skip_special_tokens=True
             )
             
-            # Tokenize input
-            inputs = self.tokenizer.encode(prompt, return_tensors="pt").to(self.device)
+            # Tokenize input, copying to the device on the side stream
+            if self._copy_stream is not None:
+                with torch.cuda.stream(self._copy_stream):
+                    inputs = self._encode(prompt)
+                compute_stream = torch.cuda.current_stream()
+                compute_stream.wait_stream(self._copy_stream)
+                for tensor in inputs.values():
+                    tensor.record_stream(compute_stream)
+            else:
+                inputs = self._encode(prompt)
             
             # Run generation in separate thread
             generation_kwargs = {
                 **gen_params,
-                "inputs": inputs,
+                **inputs,
                 "streamer": streamer,
             }
             
-            thread = Thread(target=self.model.generate, kwargs=generation_kwargs)
-            thread.start()
+            future = self._gen_executor.submit(
+                self._stream_in_inference_mode, streamer, generation_kwargs
+            )
             
             # Yield tokens as they stream in
             for token in streamer:
                 yield token
             
-            thread.join()
+            # Surface any exception raised inside the generation thread
+            future.result()
             logger.debug("Streaming generation completed")
         
         except Exception as e:
             logger.error(f"Streaming generation failed: {str(e)}")
             raise RuntimeError(f"Streaming generation failed: {str(e)}") from e
     
+    def _stream_in_inference_mode(
+        self,
+        streamer: TextIteratorStreamer,
+        generation_kwargs: Dict[str, Any]
+    ) -> Any:
+        """
+        Run model.generate for a stream (used from the generation worker).
+        
+        The streamer is always ended, so a failed generation stops the
+        consumer's loop and its exception is re-raised from the future.
+        """
+        try:
+            with self._generate_lock, torch.inference_mode():
+                return self.model.generate(**generation_kwargs)
+        finally:
+            streamer.end()
+    
     def analyze_intent(self, text: str) -> IntentAnalysis:
         """
         Analyze user intent from input text.
@@ -424,23 +1006,20 @@ class MistralLLM:
         
         try:
             # Create intent analysis prompt
-            intent_prompt = f"""Analyze the following user text and provide:
-1. Primary intent (single word or short phrase)
-2. Confidence level (0-1)
-3. Any secondary intents
-4. Key entities mentioned
-5. Sentiment (positive/negative/neutral)
-6. Whether action is required
-
-Text: "{text}"
+            intent_prompt = f"""{_INTENT_PROMPT_PREFIX}Text: "{text}"
 
 Respond in JSON format."""
             
-            # Generate analysis
+            # Generate analysis greedily (sampling only hurts structured JSON),
+            # skipping prefill of the constant prefix
             analysis_text = self.generate(
                 intent_prompt,
-                max_length=256,
-                temperature=0.3,
+                temperature=1.0,
+                top_p=1.0,
+                prefix=_INTENT_PROMPT_PREFIX,
+                do_sample=False,
+                num_beams=1,
+                max_new_tokens=256,
             )
             
             # Parse response
@@ -453,6 +1032,44 @@ Respond in JSON format."""
             logger.error(f"Intent analysis failed: {str(e)}")
             raise RuntimeError(f"Intent analysis failed: {str(e)}") from e
     
+    def _prefix_kv(self, prefix: str, prompt: str) -> Optional[Any]:
+        """
+        Return a fresh copy of the KV cache for a prompt prefix.
+        
+        Each prefix is prefilled once and kept in a small LRU keyed by a
+        digest of its text. The cache is only used when the full prompt
+        tokenizes to the cached prefix ids followed by more tokens;
+        otherwise None is returned and the prompt is prefilled in full.
+        """
+        if not prompt.startswith(prefix):
+            return None
+        key = hashlib.blake2b(prefix.encode("utf-8"), digest_size=16).hexdigest()
+        try:
+            with self._prefix_kv_lock:
+                entry = self._prefix_kv_cache.get(key)
+                if entry is not None:
+                    self._prefix_kv_cache.move_to_end(key)
+            if entry is None:
+                prefix_ids = self.tokenizer.encode(prefix, return_tensors="pt").to(self.device)
+                with self._generate_lock, torch.inference_mode():
+                    out = self.model(prefix_ids, use_cache=True)
+                entry = (prefix_ids, out.past_key_values)
+                with self._prefix_kv_lock:
+                    self._prefix_kv_cache[key] = entry
+                    if len(self._prefix_kv_cache) > self.PREFIX_KV_CACHE_SIZE:
+                        self._prefix_kv_cache.popitem(last=False)
+            
+            prefix_ids, past_key_values = entry
+            prompt_ids = self._encode(prompt)["input_ids"]
+            n = prefix_ids.shape[1]
+            if prompt_ids.shape[1] <= n or not torch.equal(prompt_ids[0, :n], prefix_ids[0]):
+                return None
+            # generate() extends the cache in place, so hand out a copy
+            return copy.deepcopy(past_key_values)
+        except Exception as e:
+            logger.debug(f"Prefix KV cache unavailable: {str(e)}")
+            return None
+    
     def _parse_intent_response(self, response: str, original_text: str) -> IntentAnalysis:
         """
         Parse intent analysis response from model.
@@ -466,13 +1083,15 @@ Respond in JSON format."""
         """
         try:
             # Try to extract JSON from response
-            json_start = response.find('{')
-            json_end = response.rfind('}') + 1
+            json_str = _find_json_object(response)
+            data = None
+            if json_str is not None:
+                try:
+                    data = _json_loads(json_str)
+                except ValueError:
+                    pass
             
-            if json_start >= 0 and json_end > json_start:
-                json_str = response[json_start:json_end]
-                data = json.loads(json_str)
-            else:
+            if not isinstance(data, dict):
                 # Fallback parsing
                 data = self._fallback_intent_parsing(original_text)
             
@@ -497,23 +1116,10 @@ Respond in JSON format."""
     
     def _fallback_intent_parsing(self, text: str) -> Dict[str, Any]:
         """Fallback intent parsing without JSON."""
-        text_lower = text.lower()
-        
-        # Simple keyword-based intent detection
-        intents = {
-            "help": ["help", "assist", "support"],
-            "generate": ["generate", "create", "write", "produce"],
-            "analyze": ["analyze", "analyze", "examine", "review"],
-            "summarize": ["summarize", "summary", "brief"],
-            "translate": ["translate", "translation"],
-            "explain": ["explain", "clarify", "elaborate"],
-        }
-        
-        detected_intent = "query"
-        for intent, keywords in intents.items():
-            if any(kw in text_lower for kw in keywords):
-                detected_intent = intent
-                break
+        matched = _match_intents(text.lower())
+        detected_intent = (
+            min(matched, key=_INTENT_PRIORITY.__getitem__) if matched else "query"
+        )
         
         return {
             "primary_intent": detected_intent,
@@ -525,6 +1131,79 @@ Respond in JSON format."""
             "action_type": None,
         }
     
+    def generate_batch(
+        self,
+        prompts: List[str],
+        **kwargs
+    ) -> List[str]:
+        """
+        Generate text for several prompts in one padded batch.
+        
+        Unlike batch_generate, failures raise instead of being returned as
+        error strings. If the batch does not fit in GPU memory the prompts
+        are generated one at a time. As in generate(), completions of
+        non-sampling calls are cached and only uncached prompts are decoded.
+        
+        Args:
+            prompts: List of input prompts
+            **kwargs: Generation parameters
+        
+        Returns:
+            Generated texts, in prompt order
+        
+        Raises:
+            ValueError: If prompts list is empty
+            RuntimeError: If generation fails
+        """
+        if not prompts or not isinstance(prompts, list):
+            raise ValueError("Prompts must be a non-empty list")
+        
+        logger.info(f"Batch generating text for {len(prompts)} prompts")
+        
+        gen_params = self._prepare_gen_params(kwargs)
+        
+        results: List[Optional[str]] = [None] * len(prompts)
+        keys: List[Optional[str]] = [None] * len(prompts)
+        if not gen_params.get("do_sample"):
+            for i, prompt in enumerate(prompts):
+                keys[i] = self._response_cache_key(prompt, gen_params)
+                results[i] = self._lookup_response(keys[i])
+        pending = [i for i, text in enumerate(results) if text is None]
+        if not pending:
+            return results
+        
+        try:
+            inputs = self.tokenizer(
+                [prompts[i] for i in pending],
+                return_tensors="pt",
+                padding=True,
+                truncation=True,
+            ).to(self.device)
+            
+            with self._generate_lock, torch.inference_mode():
+                outputs = self.model.generate(**inputs, **gen_params)
+            
+            texts = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+        
+        except torch.cuda.OutOfMemoryError:
+            logger.warning("Batched generation ran out of memory, retrying one prompt at a time")
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+            # generate() caches these itself
+            for i in pending:
+                results[i] = self.generate(prompts[i], **kwargs)
+            return results
+        
+        except Exception as e:
+            logger.error(f"Batch generation failed: {str(e)}")
+            raise RuntimeError(f"Batch generation failed: {str(e)}") from e
+        
+        for i, text in zip(pending, texts):
+            results[i] = text
+            if keys[i] is not None:
+                self._store_response(keys[i], text)
+        return results
+    
     def batch_generate(
         self,
         prompts: List[str],
@@ -538,7 +1217,7 @@ Respond in JSON format."""
             **kwargs: Generation parameters
         
         Returns:
-            List of generated texts
+            List of generated texts; failed prompts yield "[Error: ...]"
         
         Raises:
             ValueError: If prompts list is empty
@@ -546,17 +1225,19 @@ Respond in JSON format."""
         if not prompts or not isinstance(prompts, list):
             raise ValueError("Prompts must be a non-empty list")
         
-        logger.info(f"Batch generating text for {len(prompts)} prompts")
+        try:
+            return self.generate_batch(prompts, **kwargs)
+        except RuntimeError:
+            logger.warning("Retrying batch one prompt at a time")
         
-        results = []
+        results: List[str] = [""] * len(prompts)
         for i, prompt in enumerate(prompts):
             try:
-                result = self.generate(prompt, **kwargs)
-                results.append(result)
+                results[i] = self.generate(prompt, **kwargs)
                 logger.debug(f"Batch generation {i+1}/{len(prompts)} complete")
             except Exception as e:
                 logger.error(f"Failed to generate for prompt {i+1}: {str(e)}")
-                results.append(f"[Error: {str(e)}]")
+                results[i] = f"[Error: {str(e)}]"
         
         return results
     
@@ -566,20 +1247,28 @@ Respond in JSON format."""
             "model_name": self.model_name,
             "model_path": self.model_path,
             "device": self.device,
+            "device_map": self.device_map,
             "dtype": str(self.dtype),
+            "attn_implementation": self.attn_implementation,
             "quantization": {
+                "mode": self.quantization,
+                "fp8": self.use_fp8,
                 "int8": self.load_in_8bit,
                 "int4": self.load_in_4bit,
             },
-            "total_parameters": sum(p.numel() for p in self.model.parameters()),
-            "trainable_parameters": sum(
-                p.numel() for p in self.model.parameters() if p.requires_grad
-            ),
+            "total_parameters": self._total_params,
+            "trainable_parameters": self._trainable_params,
         }
     
     def __del__(self) -> None:
         """Cleanup on deletion."""
         try:
+            executor = getattr(self, "_gen_executor", None)
+            if executor is not None:
+                executor.shutdown(wait=False)
+            disk_cache = getattr(self, "_disk_cache", None)
+            if disk_cache is not None:
+                disk_cache.close()
             if self.model is not None:
                 del self.model
             if self.tokenizer is not None:
@@ -591,6 +1280,99 @@ Respond in JSON format."""
             logger.warning(f"Error during cleanup: {str(e)}")
 
 
+class BatchingLLM:
+    """
+    Micro-batching front end for a shared MistralLLM.
+    
+    agenerate() calls that arrive within max_wait seconds of each other and
+    use the same generation parameters are decoded together in a single
+    generate_batch() call. Every other attribute is forwarded to the wrapped
+    model, so a BatchingLLM can stand in for a MistralLLM.
+    """
+    
+    def __init__(
+        self,
+        llm: MistralLLM,
+        max_batch_size: int = 8,
+        max_wait: float = 0.02,
+    ):
+        """
+        Args:
+            llm: Model that serves the batches
+            max_batch_size: Most prompts decoded in one batch
+            max_wait: Seconds to wait for more prompts after the first
+        """
+        self.llm = llm
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    def __getattr__(self, name: str) -> Any:
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+    
+    async def agenerate(self, prompt: str, **kwargs) -> str:
+        """Queue a prompt for the next batch and wait for its completion."""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        await self._queue.put((prompt, kwargs, future))
+        return await future
+    
+    async def aclose(self) -> None:
+        """Stop the batching worker."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+    
+    async def _run(self) -> None:
+        """Collect queued prompts into batches and dispatch them."""
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.max_batch_size - 1:
+                await asyncio.sleep(self.max_wait)
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            # Only calls with the same generation parameters can share a batch
+            groups: Dict[str, List[Tuple[str, Dict[str, Any], asyncio.Future]]] = {}
+            for item in batch:
+                params = {k: v for k, v in item[1].items() if k != "prefix"}
+                groups.setdefault(repr(sorted(params.items())), []).append(item)
+            for group in groups.values():
+                await self._dispatch(group)
+    
+    async def _dispatch(self, group: List[Tuple[str, Dict[str, Any], asyncio.Future]]) -> None:
+        """Generate one group of prompts and resolve their futures."""
+        prompts = [prompt for prompt, _, _ in group]
+        kwargs = group[0][1]
+        try:
+            if len(group) == 1:
+                # A lone prompt keeps generate()'s response and prefix caches
+                results = [await self.llm.agenerate(prompts[0], **kwargs)]
+            else:
+                params = {k: v for k, v in kwargs.items() if k != "prefix"}
+                results = await asyncio.to_thread(self.llm.generate_batch, prompts, **params)
+        except Exception as e:
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, _, future), text in zip(group, results):
+            # The caller may have been cancelled while the batch ran
+            if not future.done():
+                future.set_result(text)
+
+
 # ============================================================================
 # Example Usage
 # ============================================================================
@@ -740,7 +1522,7 @@ if __name__ == "__main__":
     
     Note: These examples require a GPU with sufficient VRAM.
     For CPU-only environments, use smaller model variants or
-    enable quantization (load_in_8bit=True or load_in_4bit=True).
+    enable quantization (load_in_4bit=True is preferred over load_in_8bit=True).
     """
     
     print("JarvisCO Mistral 7B Integration Examples")
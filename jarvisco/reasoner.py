@@ -17,17 +17,43 @@ Date: 2025-12-30
 
 import logging
 import asyncio
-from typing import Dict, List, Any, Optional, Tuple
+import json
+import re
+import time
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
-import ast
-import subprocess
+import io
+import tokenize
 
 from jarvisco.analyzer import CodeAnalyzer, CodeIssue
-from jarvisco.mistral_llm import MistralLLM
+from jarvisco.mistral_llm import BatchingLLM, MistralLLM
 
 logger = logging.getLogger(__name__)
 
+# Shared opening of every reasoner prompt, so all calls start with the
+# same tokens (lets prefix caches in the LLM backend hit)
+PROMPT_PREFIX = "You are JarvisCO, a Python code reasoning engine.\n"
+
+# Upper bound on a single mypy run during validation (seconds)
+TYPE_CHECK_TIMEOUT = 5
+
+# Decode budget for the planning call (tokens)
+PLAN_TOKEN_BUDGET = 256
+
+# Every reasoner call decodes greedily: structured answers do not benefit
+# from sampling, and deterministic calls hit the LLM's response cache
+GREEDY_DECODING = {"do_sample": False, "num_beams": 1, "temperature": 1.0, "top_p": 1.0}
+
+# A numbered step ("3. thought") or an "Action: ..." line, one match per line.
+_STEP_LINE_RE = re.compile(r"^(?:(\d)([^\n]*)|[ \t]*Action:([^\n]*))", re.MULTILINE)
+
+# Closes every prompt; the model's answer starts after it
+_FORMAT_END_TAG = "</format>"
+
+# Body of a fenced ``` or ```python block
+_CODE_BLOCK_RE = re.compile(r"```(?:python)?\s*\n(.*?)\n```", re.DOTALL)
+
 
 class TransformationType(Enum):
     """Types of code transformations."""
@@ -78,9 +104,21 @@ class CodeReasoner:
     5. Validate against constraints
     """
     
-    def __init__(self, llm: MistralLLM):
-        """Initialize reasoner."""
+    # Transformations simple enough for the small model, and the largest
+    # complexity + len(code) // 500 score routed to it
+    SMALL_MODEL_TYPES = (TransformationType.DOCUMENT, TransformationType.TEST)
+    SMALL_MODEL_MAX_SCORE = 3
+    
+    def __init__(self, llm: MistralLLM, small_llm: Optional[MistralLLM] = None):
+        """
+        Initialize reasoner.
+        
+        Args:
+            llm: Language model for transformations
+            small_llm: Cheaper model for simple transformations (optional)
+        """
         self.llm = llm
+        self.small_llm = small_llm
         self.analyzer = CodeAnalyzer()
         self.reasoning_history: List[ReasoningStep] = []
         
@@ -89,7 +127,8 @@ class CodeReasoner:
         code: str,
         intent: str,
         transform_type: TransformationType = TransformationType.REFACTOR,
-        context: Optional[str] = None
+        context: Optional[str] = None,
+        analysis: Optional[Dict[str, Any]] = None
     ) -> TransformationResult:
         """
         Transform code based on intent using chain-of-thought reasoning.
@@ -99,55 +138,111 @@ class CodeReasoner:
             intent: Natural language description of desired transformation
             transform_type: Type of transformation
             context: Additional context (dependencies, requirements, etc)
+            analysis: Analysis of code the caller already ran (see
+                transform_code_stream)
             
         Returns:
             TransformationResult with reasoning and transformed code
         """
+        async for event, payload in self.transform_code_stream(
+            code, intent, transform_type, context, analysis
+        ):
+            if event == "result":
+                return payload
+        raise RuntimeError("Transformation finished without a result")
+    
+    async def transform_code_stream(
+        self,
+        code: str,
+        intent: str,
+        transform_type: TransformationType = TransformationType.REFACTOR,
+        context: Optional[str] = None,
+        analysis: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Transform code, yielding progress as each step completes.
+        
+        Args:
+            code: Source code to transform
+            intent: Natural language description of desired transformation
+            transform_type: Type of transformation
+            context: Additional context (dependencies, requirements, etc)
+            analysis: Analysis of code the caller already ran; when given,
+                the full analysis (including mypy) is skipped here
+            
+        Yields:
+            (event, payload) pairs: ("analysis", metrics dict),
+            ("intent", intent understanding dict), one ("step", ReasoningStep)
+            per reasoning step, ("code", transformed code) and finally
+            ("result", TransformationResult)
+        """
         
+        started = time.perf_counter()
         result = TransformationResult(
             success=False,
             original_code=code,
             transformation_type=transform_type
         )
         
-        # STEP 1: Analyze current code
-        logger.info("Step 1: Analyzing code structure...")
-        analysis = self.analyzer.analyze(code)
+        # STEP 1: Analyze current code (parse + mypy, off the event loop)
+        if analysis is None:
+            analysis = await asyncio.to_thread(self.analyzer.analyze, code)
         result.issues_found = [
             CodeIssue(**issue) for issue in analysis.get('issues', [])
         ]
+        yield "analysis", analysis.get('metrics', {})
+        
+        llm = self._select_llm(code, analysis, transform_type)
+        
+        # Comment- and blank-free copy for the analysis prompts; code
+        # generation still sees the original
+        prompt_code = self._minify_for_prompt(code)
         
         # STEP 2: Semantic understanding of intent
-        logger.info("Step 2: Understanding intent semantically...")
-        intent_understanding = await self._understand_intent(intent, code, context)
+        intent_understanding = await self._understand_intent(intent, prompt_code, context, llm)
+        yield "intent", intent_understanding
         
         # STEP 3: Chain-of-thought reasoning
-        logger.info("Step 3: Reasoning about transformation...")
         reasoning_steps = await self._reason_transformation(
-            code=code,
+            code=prompt_code,
             intent=intent,
             analysis=analysis,
             intent_understanding=intent_understanding,
-            transform_type=transform_type
+            transform_type=transform_type,
+            llm=llm
         )
         result.reasoning_steps = reasoning_steps
+        for step in reasoning_steps:
+            yield "step", step
         
-        # STEP 4: Generate transformation
-        logger.info("Step 4: Generating transformed code...")
-        transformed_code = await self._generate_transformation(
-            code=code,
+        # Validation can only lower confidence, so when it already cannot
+        # pass the threshold the explanation would be thrown away
+        explain = self._calculate_confidence(
             reasoning_steps=reasoning_steps,
-            transform_type=transform_type
-        )
+            validation_errors=[],
+            analysis=analysis
+        ) > 0.7
+        
+        # STEPS 4 and 7 depend only on the reasoning steps, so the code and
+        # its explanation are decoded together in one batch
+        prompts = [self._build_generation_prompt(code, reasoning_steps)]
+        if explain:
+            prompts.append(self._build_explanation_prompt(reasoning_steps, transform_type))
+        responses = await self._generate_batch(prompts, llm)
+        transformed_code = self._extract_code_block(responses[0]) or code
         result.transformed_code = transformed_code
+        if explain:
+            result.explanation = responses[1]
+        yield "code", transformed_code
         
         # STEP 5: Validate transformation
-        logger.info("Step 5: Validating generated code...")
-        validation_errors = await self._validate_code(transformed_code)
+        post_analysis = await asyncio.to_thread(self.analyzer.analyze_fast, transformed_code)
+        validation_errors = await self._validate_code(
+            transformed_code, post_analysis.get('issues', [])
+        )
         result.validation_errors = validation_errors
         
         # STEP 6: Calculate confidence
-        logger.info("Step 6: Calculating confidence score...")
         confidence = self._calculate_confidence(
             reasoning_steps=reasoning_steps,
             validation_errors=validation_errors,
@@ -155,21 +250,27 @@ class CodeReasoner:
         )
         result.confidence_score = confidence
         
-        # STEP 7: Generate explanation
-        result.explanation = await self._generate_explanation(
-            reasoning_steps=reasoning_steps,
-            transform_type=transform_type
-        )
-        
         result.success = len(validation_errors) == 0 and confidence > 0.7
+        if not explain:
+            result.explanation = (
+                f"Transformation rejected: {len(validation_errors)} validation errors, "
+                f"confidence={confidence:.2f}"
+            )
         
-        return result
+        logger.info(
+            f"Transformation ({transform_type.value}) done in "
+            f"{(time.perf_counter() - started) * 1000:.0f}ms: "
+            f"{len(reasoning_steps)} steps, confidence {confidence:.2f}, "
+            f"{len(validation_errors)} validation errors"
+        )
+        yield "result", result
     
     async def _understand_intent(
         self,
         intent: str,
         code: str,
-        context: Optional[str] = None
+        context: Optional[str] = None,
+        llm: Optional[MistralLLM] = None
     ) -> Dict[str, Any]:
         """
         Understand intent semantically (not just keywords).
@@ -177,38 +278,28 @@ class CodeReasoner:
         Returns: Intent understanding with semantic analysis
         """
         
-        semantic_analysis_prompt = f"""
-Analyze this code transformation intent semantically:
-
-Intent: "{intent}"
-
-Code to transform:
-```python
-{code}
-```
-
-{f"Context: {context}" if context else ""}
-
-Identify:
-1. What is the PRIMARY goal? (refactor, optimize, fix, feature, etc)
-2. What CONSTRAINTS must be maintained? (API compatibility, performance, etc)
-3. What PATTERNS are involved? (design patterns, idioms, etc)
-4. What RISKS exist? (breaking changes, performance, security, etc)
-5. What DEPENDENCIES are relevant? (external libs, internal modules, etc)
-
-Provide semantic understanding, not just surface-level interpretation.
+        context_block = f"<context>{context}</context>\n" if context else ""
+        semantic_analysis_prompt = f"""<task>semantic_intent_analysis</task>
+<intent>{intent}</intent>
+{context_block}<fields>goal,constraints,patterns,risks,deps</fields>
+<format>JSON; ≤8 words per field</format>
 """
         
-        response = self.llm.generate(semantic_analysis_prompt)
+        response = await self._generate_for_code(code, semantic_analysis_prompt, llm)
         
-        # Parse response into structured understanding
+        # The answer follows the prompt's closing <format> tag; without it
+        # there is no answer to parse (only the echoed prompt and code)
+        data = {}
+        end = response.rfind(_FORMAT_END_TAG)
+        if end != -1:
+            data = self._parse_json_object(response[end + len(_FORMAT_END_TAG):]) or {}
         return {
             "raw_understanding": response,
-            "primary_goal": self._extract_from_response(response, "PRIMARY goal"),
-            "constraints": self._extract_from_response(response, "CONSTRAINTS"),
-            "patterns": self._extract_from_response(response, "PATTERNS"),
-            "risks": self._extract_from_response(response, "RISKS"),
-            "dependencies": self._extract_from_response(response, "DEPENDENCIES")
+            "primary_goal": self._field_text(data.get("goal")),
+            "constraints": self._field_text(data.get("constraints")),
+            "patterns": self._field_text(data.get("patterns")),
+            "risks": self._field_text(data.get("risks")),
+            "dependencies": self._field_text(data.get("deps"))
         }
     
     async def _reason_transformation(
@@ -217,7 +308,8 @@ Provide semantic understanding, not just surface-level interpretation.
         intent: str,
         analysis: Dict,
         intent_understanding: Dict,
-        transform_type: TransformationType
+        transform_type: TransformationType,
+        llm: Optional[MistralLLM] = None
     ) -> List[ReasoningStep]:
         """
         Chain-of-thought reasoning about the transformation.
@@ -225,107 +317,53 @@ Provide semantic understanding, not just surface-level interpretation.
         Breaks down the transformation into logical steps.
         """
         
-        reasoning_prompt = f"""
-You are a code reasoning engine. Think step-by-step about transforming this code.
-
-INTENT: {intent}
-TRANSFORMATION TYPE: {transform_type.value}
-
-CURRENT CODE ANALYSIS:
-- Complexity: {analysis.get('complexity', '?')}
-- Functions: {len(analysis.get('entities', {}).get('function', []))}
-- Issues: {len(analysis.get('issues', []))}
-
-SEMANTIC UNDERSTANDING:
-- Goal: {intent_understanding.get('primary_goal')}
-- Constraints: {intent_understanding.get('constraints')}
-- Risks: {intent_understanding.get('risks')}
-
-CODE:
-```python
-{code}
-```
-
-Now reason step-by-step (use numbered steps):
-1. First, identify what SPECIFICALLY needs to change
-2. Then, list the SEQUENCE of transformations
-3. For each step, explain the RATIONALE
-4. Consider EDGE CASES and RISKS
-5. Validate that CONSTRAINTS are maintained
-
-Be specific and actionable.
+        reasoning_prompt = f"""<task>plan_transformation</task>
+<intent>{intent}</intent>
+<type>{transform_type.value}</type>
+<analysis>complexity={analysis.get('complexity', '?')}; functions={len(analysis.get('entities', {}).get('function', []))}; issues={len(analysis.get('issues', []))}</analysis>
+<understanding>goal={intent_understanding.get('primary_goal')}; constraints={intent_understanding.get('constraints')}; risks={intent_understanding.get('risks')}</understanding>
+<format>≤5 numbered draft steps, ≤5 words each; after each step a line "Action: <≤5 words>"</format>
 """
         
-        response = self.llm.generate(reasoning_prompt)
+        response = await self._generate_for_code(
+            code, reasoning_prompt, llm, max_new_tokens=PLAN_TOKEN_BUDGET
+        )
         
         # Parse reasoning steps from response
         steps = self._parse_reasoning_steps(response)
         return steps
     
-    async def _generate_transformation(
+    async def _validate_code(
         self,
         code: str,
-        reasoning_steps: List[ReasoningStep],
-        transform_type: TransformationType
-    ) -> str:
-        """
-        Generate the actual transformed code.
-        
-        Uses the reasoning steps as guidance for generation.
-        """
-        
-        steps_text = "\n".join([
-            f"Step {step.step_num}: {step.thought}\nAction: {step.action}"
-            for step in reasoning_steps
-        ])
-        
-        generation_prompt = f"""
-Based on this reasoning, generate the transformed code:
-
-{steps_text}
-
-ORIGINAL CODE:
-```python
-{code}
-```
-
-Generate the COMPLETE transformed code that follows all the reasoning steps.
-Ensure:
-1. Code is syntactically correct Python
-2. All steps are implemented
-3. No breaking changes to interfaces (unless intentional)
-4. Code is well-structured and readable
-5. Comments explain non-obvious transformations
-
-Return ONLY the code, wrapped in ```python blocks.
-"""
-        
-        response = self.llm.generate(generation_prompt)
-        
-        # Extract code block from response
-        transformed = self._extract_code_block(response)
-        return transformed if transformed else code
-    
-    async def _validate_code(self, code: str) -> List[str]:
+        precomputed_issues: Optional[List[Dict]] = None
+    ) -> List[str]:
         """
         Validate generated code.
         
+        Args:
+            code: Code to validate
+            precomputed_issues: Issues from a structural analysis of code
+                the caller already ran (analyzed here if not given)
+        
         Returns list of validation errors (empty if valid).
         """
         errors = []
         
-        # Syntax validation
+        # Syntax validation (the tree is cached for the analysis below)
         try:
-            ast.parse(code)
+            self.analyzer.parse(code)
         except SyntaxError as e:
             errors.append(f"Syntax error at line {e.lineno}: {e.msg}")
         
-        # Type checking
-        type_errors = self._check_types(code)
-        errors.extend(type_errors)
+        # Type checking (warm dmypy server, off the event loop, abandoned
+        # after TYPE_CHECK_TIMEOUT seconds)
+        errors.extend(await asyncio.to_thread(self._check_types, code))
         
-        # Code quality checks
-        quality_issues = self.analyzer.analyze(code).get('issues', [])
+        # Code quality checks (mypy already ran above, so structure only)
+        quality_issues = precomputed_issues
+        if quality_issues is None:
+            quality_issues = self.analyzer.analyze_fast(code).get('issues', [])
         critical_issues = [
             issue for issue in quality_issues
             if isinstance(issue, dict) and issue.get('severity') == 'error'
@@ -336,23 +374,11 @@ Return ONLY the code, wrapped in ```python blocks.
     
     def _check_types(self, code: str) -> List[str]:
         """Type check code using mypy."""
-        try:
-            result = subprocess.run(
-                ['python', '-m', 'mypy', '-'],
-                input=code,
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            
-            errors = []
-            for line in result.stdout.split('\n'):
-                if 'error' in line.lower():
-                    errors.append(line)
-            return errors
-        
-        except (FileNotFoundError, subprocess.TimeoutExpired):
-            return []
+        return [
+            f"Type error at line {issue['line']}: {issue['message']}"
+            for issue in self.analyzer.check_types(code, timeout=TYPE_CHECK_TIMEOUT)
+            if issue['severity'] == 'error'
+        ]
     
     def _calculate_confidence(
         self,
@@ -381,15 +407,100 @@ Return ONLY the code, wrapped in ```python blocks.
         
         return min(final_confidence, 1.0)
     
-    async def _generate_explanation(
+    # Helper methods
+    
+    def _select_llm(
         self,
-        reasoning_steps: List[ReasoningStep],
+        code: str,
+        analysis: Dict,
         transform_type: TransformationType
+    ) -> MistralLLM:
+        """Route small documentation/test jobs to the small model, if any."""
+        if self.small_llm is None or transform_type not in self.SMALL_MODEL_TYPES:
+            return self.llm
+        size_score = analysis.get('complexity', 0) + len(code) // 500
+        if size_score < self.SMALL_MODEL_MAX_SCORE:
+            logger.debug(f"Routing {transform_type.value} (score {size_score}) to small model")
+            return self.small_llm
+        return self.llm
+    
+    async def _generate_for_code(
+        self,
+        code: str,
+        task: str,
+        llm: Optional[MistralLLM] = None,
+        **gen_kwargs
     ) -> str:
-        """Generate human-readable explanation of the transformation."""
+        """
+        Run a prompt about code, with the code ahead of the task.
         
-        summary_prompt = f"""
-Summarize this code transformation in 2-3 sentences:
+        Prompts about the same code then share a leading prefix whose KV
+        cache the LLM computes once.
+        """
+        prefix = f"{PROMPT_PREFIX}<code>\n{code}\n</code>\n"
+        return await (llm or self.llm).agenerate(
+            prefix + task, prefix=prefix, **GREEDY_DECODING, **gen_kwargs
+        )
+    
+    async def _generate_batch(
+        self,
+        prompts: List[str],
+        llm: Optional[MistralLLM] = None
+    ) -> List[str]:
+        """
+        Decode independent prompts together.
+        
+        A BatchingLLM gets one agenerate() per prompt so they join its
+        batches; a bare MistralLLM decodes them in one generate_batch().
+        """
+        llm = llm or self.llm
+        prompts = [PROMPT_PREFIX + prompt for prompt in prompts]
+        if isinstance(llm, BatchingLLM):
+            return list(await asyncio.gather(
+                *(llm.agenerate(prompt, **GREEDY_DECODING) for prompt in prompts)
+            ))
+        return await asyncio.to_thread(llm.generate_batch, prompts, **GREEDY_DECODING)
+    
+    def _build_generation_prompt(
+        self,
+        code: str,
+        reasoning_steps: List[ReasoningStep]
+    ) -> str:
+        """Build the prompt that asks for the transformed code."""
+        steps_text = "\n".join([
+            f"Step {step.step_num}: {step.thought}\nAction: {step.action}"
+            for step in reasoning_steps
+        ])
+        
+        return f"""
+Based on this reasoning, generate the transformed code:
+
+{steps_text}
+
+ORIGINAL CODE:
+```python
+{code}
+```
+
+Generate the COMPLETE transformed code that follows all the reasoning steps.
+Ensure:
+1. Code is syntactically correct Python
+2. All steps are implemented
+3. No breaking changes to interfaces (unless intentional)
+4. Code is well-structured and readable
+5. Comments explain non-obvious transformations
+
+Return ONLY the code, wrapped in ```python blocks.
+"""
+    
+    def _build_explanation_prompt(
+        self,
+        reasoning_steps: List[ReasoningStep],
+        transform_type: TransformationType
+    ) -> str:
+        """Build the prompt that asks for a short explanation."""
+        return f"""
+Summarize this code transformation in 2-3 sentences (under 60 words):
 
 Transformation Type: {transform_type.value}
 
@@ -398,67 +509,91 @@ Reasoning:
 
 Be clear and concise.
 """
+    
+    @staticmethod
+    def _minify_for_prompt(code: str) -> str:
+        """
+        Shrink code for embedding in a prompt.
         
-        explanation = self.llm.generate(summary_prompt)
-        return explanation
+        Drops comments and blank lines and indents one space per block
+        level. String literals (including multi-line ones) are untouched.
+        Code that does not tokenize is returned unchanged.
+        """
+        try:
+            tokens = list(tokenize.generate_tokens(io.StringIO(code).readline))
+        except (tokenize.TokenError, IndentationError, SyntaxError):
+            return code
+        
+        depth = 0
+        line_depth: Dict[int, Tuple[int, int]] = {}  # line -> (depth, first col)
+        comment_col: Dict[int, int] = {}
+        verbatim = set()  # lines continuing a multi-line token
+        for tok in tokens:
+            if tok.type == tokenize.INDENT:
+                depth += 1
+            elif tok.type == tokenize.DEDENT:
+                depth -= 1
+            elif tok.type == tokenize.COMMENT:
+                comment_col[tok.start[0]] = tok.start[1]
+            elif tok.type not in (tokenize.NL, tokenize.NEWLINE, tokenize.ENDMARKER):
+                line_depth.setdefault(tok.start[0], (depth, tok.start[1]))
+                verbatim.update(range(tok.start[0] + 1, tok.end[0] + 1))
+        
+        out = []
+        for lineno, line in enumerate(code.splitlines(), 1):
+            end = comment_col.get(lineno, len(line))
+            if lineno in verbatim:
+                out.append(line[:end].rstrip() if lineno in comment_col else line)
+            elif lineno in line_depth:
+                level, col = line_depth[lineno]
+                out.append(" " * level + line[col:end].rstrip())
+        return "\n".join(out)
     
-    # Helper methods
+    @staticmethod
+    def _parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+        """Decode the first JSON object embedded in text."""
+        decoder = json.JSONDecoder()
+        start = text.find('{')
+        while start != -1:
+            try:
+                obj, _ = decoder.raw_decode(text, start)
+                if isinstance(obj, dict):
+                    return obj
+            except ValueError:
+                pass
+            start = text.find('{', start + 1)
+        return None
     
-    def _extract_from_response(self, response: str, key: str) -> str:
-        """Extract a specific section from LLM response."""
-        lines = response.split('\n')
-        result = []
-        capturing = False
-        
-        for line in lines:
-            if key.upper() in line.upper():
-                capturing = True
-                continue
-            if capturing:
-                if line.strip().startswith('-') or line.strip().startswith('•'):
-                    result.append(line.strip())
-                elif line.strip() and not line[0].isdigit():
-                    break
-        
-        return '\n'.join(result) or "Not found"
+    @staticmethod
+    def _field_text(value: Any) -> str:
+        """Render one field of the structured intent analysis as text."""
+        if not value:
+            return "Not found"
+        if isinstance(value, list):
+            return '\n'.join(f"- {item}" for item in value)
+        return str(value)
     
     def _parse_reasoning_steps(self, response: str) -> List[ReasoningStep]:
         """Parse numbered reasoning steps from LLM response."""
         steps = []
-        current_step = None
-        
-        for line in response.split('\n'):
-            # Match numbered steps
-            if line.strip() and line[0].isdigit():
-                if current_step:
-                    steps.append(current_step)
-                
-                step_num = int(line[0])
-                thought = line.split('.', 1)[1].strip() if '.' in line else line
-                current_step = ReasoningStep(
-                    step_num=step_num,
+        
+        for match in _STEP_LINE_RE.finditer(response):
+            digit, rest, action = match.groups()
+            if digit:
+                thought = rest.split('.', 1)[1].strip() if '.' in rest else digit + rest
+                steps.append(ReasoningStep(
+                    step_num=int(digit),
                     thought=thought,
                     action=""
-                )
-            elif current_step and line.strip().startswith('Action:'):
-                current_step.action = line.split(':', 1)[1].strip()
-        
-        if current_step:
-            steps.append(current_step)
+                ))
+            elif steps:
+                steps[-1].action = action.strip()
         
         return steps
     
     def _extract_code_block(self, response: str) -> Optional[str]:
         """Extract Python code block from LLM response."""
-        lines = response.split('\n')
-        in_block = False
-        code_lines = []
-        
-        for line in lines:
-            if '```python' in line or '```' in line:
-                in_block = not in_block
-                continue
-            if in_block:
-                code_lines.append(line)
-        
-        return '\n'.join(code_lines) if code_lines else None
+        # The response echoes the prompt, whose fences hold the original
+        # code; the generated block is the last one.
+        blocks = _CODE_BLOCK_RE.findall(response)
+        return blocks[-1] if blocks else None
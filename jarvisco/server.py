@@ -14,25 +14,39 @@ Author: JarvisCO
 Date: 2025-12-30
 """
 
+import argparse
+import importlib.util
+import json
 import logging
+import time
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import AsyncIterator, Optional
 import uvicorn
 from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
 from jarvisco.analyzer import CodeAnalyzer
 from jarvisco.reasoner import CodeReasoner, TransformationType
 from jarvisco.formatter import OutputFormatter
-from jarvisco.mistral_llm import MistralLLM
+from jarvisco.mistral_llm import BatchingLLM, MistralLLM
 from jarvisco.agent import CodeReasoningAgent
 from jarvisco import __version__
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# C-accelerated event loop and HTTP parser for uvicorn, when installed
+UVLOOP_AVAILABLE = importlib.util.find_spec("uvloop") is not None
+HTTPTOOLS_AVAILABLE = importlib.util.find_spec("httptools") is not None
+
 logger = logging.getLogger(__name__)
 
 # Global instances
-llm_instance: Optional[MistralLLM] = None
+llm_instance: Optional[BatchingLLM] = None
 agent_instance: Optional[CodeReasoningAgent] = None
 analyzer = CodeAnalyzer()
 formatter = OutputFormatter()
@@ -86,12 +100,16 @@ async def lifespan(app: FastAPI):
     """Application lifespan."""
     global llm_instance, agent_instance
     
-    logger.info("Starting JarvisCO API Server (Copilot-Level)...")
+    started = time.perf_counter()
     try:
-        llm_instance = MistralLLM(model_name="mistral-7b-instruct", device="auto")
+        # Concurrent requests share the model through one batching queue
+        llm_instance = BatchingLLM(MistralLLM(model_name="mistral-7b-instruct", device="auto"))
         agent_instance = CodeReasoningAgent(llm_instance)
         await agent_instance.initialize()
-        logger.info("✓ Server initialized - Copilot-level services ready")
+        logger.info(
+            f"✓ JarvisCO API Server ready in {time.perf_counter() - started:.1f}s "
+            f"(model: {llm_instance.model_name})"
+        )
     except Exception as e:
         logger.error(f"Failed to initialize: {e}")
         raise
@@ -101,6 +119,8 @@ async def lifespan(app: FastAPI):
     logger.info("Shutting down JarvisCO API Server...")
     if agent_instance:
         await agent_instance.shutdown()
+    if llm_instance:
+        await llm_instance.aclose()
 
 
 # Create FastAPI app
@@ -109,7 +129,8 @@ app = FastAPI(
     title="JarvisCO Copilot-Level API",
     description="Intelligent code analysis, reasoning, and transformation",
     version=__version__,
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse if ORJSON_AVAILABLE else JSONResponse
 )
 
 
@@ -125,7 +146,8 @@ async def health():
             "analyzer": "ready",
             "reasoner": llm_instance is not None,
             "formatter": True
-        }
+        },
+        "llm_cache": llm_instance.get_cache_stats() if llm_instance else None
     }
 
 
@@ -170,14 +192,62 @@ async def analyze(request: CodeAnalysisRequest):
 
 # Reasoning endpoints
 
+def _sse(event: str, data: object) -> str:
+    """Encode one Server-Sent Event."""
+    if ORJSON_AVAILABLE:
+        payload = orjson.dumps(data, default=str).decode("utf-8")
+    else:
+        payload = json.dumps(data, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def _transform_events(
+    request: TransformationRequest,
+    transform_type: TransformationType
+) -> AsyncIterator[str]:
+    """Stream transformation progress as Server-Sent Events."""
+    try:
+        async for event, payload in agent_instance.reasoner.transform_code_stream(
+            code=request.code,
+            intent=request.intent,
+            transform_type=transform_type,
+            context=request.context
+        ):
+            if event == "step":
+                payload = payload.__dict__
+            elif event == "result":
+                payload = {
+                    "success": payload.success,
+                    "transformed_code": payload.transformed_code,
+                    "confidence": payload.confidence_score,
+                    "explanation": payload.explanation,
+                    "reasoning_steps": [step.__dict__ for step in payload.reasoning_steps],
+                    "validation_errors": payload.validation_errors
+                }
+            yield _sse(event, payload)
+    except Exception as e:
+        logger.error(f"Transformation error: {e}")
+        yield _sse("error", {"detail": str(e)})
+
+
 @app.post("/transform", response_model=TransformationResponse)
-async def transform(request: TransformationRequest):
-    """Transform code using semantic reasoning."""
+async def transform(request: TransformationRequest, stream: bool = False):
+    """
+    Transform code using semantic reasoning.
+    
+    With ?stream=true the response is a text/event-stream that emits each
+    step as it completes, ending with a "result" event.
+    """
     if not agent_instance:
         raise HTTPException(status_code=503, detail="Agent not loaded")
     
     try:
         transform_type = TransformationType[request.transform_type.upper()]
+        if stream:
+            return StreamingResponse(
+                _transform_events(request, transform_type),
+                media_type="text/event-stream"
+            )
         result = await agent_instance.reason_transformation(
             code=request.code,
             intent=request.intent,
@@ -294,13 +364,13 @@ async def general_exception_handler(request, exc):
 
 def main():
     """Main entry point."""
-    import argparse
-    
     parser = argparse.ArgumentParser(description="JarvisCO Copilot-Level API Server")
     parser.add_argument("--host", default="0.0.0.0", help="Server host")
     parser.add_argument("--port", type=int, default=8000, help="Server port")
     parser.add_argument("--reload", action="store_true", help="Enable auto-reload")
-    parser.add_argument("--workers", type=int, default=1, help="Number of workers")
+    # Each worker process loads its own copy of the model
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of workers (each loads the model)")
     
     args = parser.parse_args()
     
@@ -312,7 +382,9 @@ def main():
         host=args.host,
         port=args.port,
         reload=args.reload,
-        workers=args.workers
+        workers=args.workers,
+        loop="uvloop" if UVLOOP_AVAILABLE else "asyncio",
+        http="httptools" if HTTPTOOLS_AVAILABLE else "h11"
     )
 
 
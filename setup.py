@@ -8,13 +8,17 @@ JarvisCO is an intelligent automation and orchestration platform
 designed to streamline workflow management and intelligent task execution.
 """
 
-from setuptools import setup, find_packages
+from pathlib import Path
 
-with open("README.md", "r", encoding="utf-8") as fh:
-    long_description = fh.read()
+from setuptools import setup
 
-with open("requirements.txt", "r", encoding="utf-8") as fh:
-    requirements = [line.strip() for line in fh if line.strip() and not line.startswith("#")]
+long_description = Path("README.md").read_text(encoding="utf-8")
+
+requirements = [
+    line.strip()
+    for line in Path("requirements.txt").read_text(encoding="utf-8").splitlines()
+    if line.strip() and not line.startswith("#")
+]
 
 setup(
     name="JarvisCO",
@@ -30,8 +34,7 @@ setup(
         "Documentation": "https://github.com/s29268979-boop/JarvisCO/wiki",
         "Source Code": "https://github.com/s29268979-boop/jarvisCO",
     },
-    packages=find_packages(where="src"),
-    package_dir={"": "src"},
+    packages=["jarvisco"],
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
@@ -41,14 +44,13 @@ setup(
         "Topic :: Office/Business",
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
         "Programming Language :: Python :: 3.10",
         "Programming Language :: Python :: 3.11",
         "Programming Language :: Python :: 3.12",
         "Operating System :: OS Independent",
     ],
-    python_requires=">=3.8",
+    python_requires=">=3.9",
     install_requires=requirements,
     extras_require={
         "dev": [
@@ -61,6 +63,10 @@ setup(
             "sphinx>=4.0",
             "sphinx-rtd-theme>=1.0",
         ],
+        "quantization": [
+            "bitsandbytes>=0.41",
+            "accelerate>=0.20",
+        ],
         "docs": [
             "sphinx>=4.0",
             "sphinx-rtd-theme>=1.0",
@@ -75,6 +81,7 @@ setup(
         ],
     },
     include_package_data=True,
+    package_data={"jarvisco": ["templates/*.j2"]},
     zip_safe=False,
     keywords="automation orchestration workflow intelligence task-management",
     license="MIT",
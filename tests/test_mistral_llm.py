@@ -0,0 +1,74 @@
+"""
+Tests for MistralLLM generation paths that do not need model weights.
+
+The model and tokenizer are replaced by mocks, so these only need torch
+and transformers to be importable.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from jarvisco import mistral_llm
+from jarvisco.mistral_llm import GenerationParameters, MistralLLM
+
+
+class _GenerationError(Exception):
+    """Stands in for a failure inside model.generate (CUDA OOM, bad shapes)."""
+
+
+def _unloaded_llm() -> MistralLLM:
+    """Build a MistralLLM around a mock model, skipping weight loading."""
+    mistral_llm._lazy_import_transformers()
+    llm = MistralLLM.__new__(MistralLLM)
+    llm.tokenizer = mock.Mock()
+    llm.model = mock.Mock()
+    llm.generation_params = GenerationParameters()
+    llm._copy_stream = None
+    llm._encode = mock.Mock(return_value={})
+    llm._gen_executor = ThreadPoolExecutor(max_workers=1)
+    llm._generate_lock = threading.Lock()
+    return llm
+
+
+def test_generate_streaming_reraises_generation_error():
+    llm = _unloaded_llm()
+    llm.model.generate.side_effect = _GenerationError("shape mismatch")
+
+    start = time.monotonic()
+    with pytest.raises(RuntimeError) as excinfo:
+        list(llm.generate_streaming("def f(): pass"))
+
+    # The worker's own exception surfaces, without waiting on the streamer
+    assert isinstance(excinfo.value.__cause__, _GenerationError)
+    assert time.monotonic() - start < 5
+
+
+def test_concurrent_generate_calls_do_not_overlap():
+    llm = _unloaded_llm()
+    running = []
+    overlaps = []
+
+    def fake_generate(**kwargs):
+        running.append(1)
+        overlaps.append(len(running))
+        time.sleep(0.01)
+        running.pop()
+        return [[0]]
+
+    llm.model.generate.side_effect = fake_generate
+    llm.tokenizer.decode.return_value = "out"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(
+            lambda i: llm.generate(f"prompt {i}", do_sample=True), range(8)
+        ))
+
+    assert results == ["out"] * 8
+    assert max(overlaps) == 1